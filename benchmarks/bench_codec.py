@@ -0,0 +1,121 @@
+"""
+Compares the construct based codec against the fast codec.
+
+Before timing, every sample frame is encoded/decoded with both codecs and
+the results are checked to be equal.
+
+    python benchmarks/bench_codec.py [-n NUMBER]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from yeelightbt.codec import ConstructCodec, FastCodec, FrameTemplate  # noqa: E402
+from yeelightbt.structures import RequestType  # noqa: E402
+
+REQUESTS = [
+    {"type": "SetOnOff", "payload": {"state": True}},
+    {"type": "SetOnOff", "payload": {"state": False}},
+    {"type": "SetColor", "payload": {"red": 255, "green": 10, "blue": 0, "brightness": 50}},
+    {"type": "SetBrightness", "payload": {"brightness": 80}},
+    {"type": "SetTemperature", "payload": {"temperature": 2700, "brightness": 40}},
+    {"type": "Pair", "payload": {}},
+    {"type": "GetAlarm", "payload": {"id": 255}},
+    {"type": "GetScene", "payload": {"id": 1}},
+    {"type": "GetSimpleFlow", "payload": {"id": 255}},
+    {"type": "SetScene", "payload": {"scene_id": 1, "text": "Reading"}},
+    {"type": "SetFlow", "payload": {"id": 1, "pkt_num": 0, "cmd": "Set", "rgb_mode": "Color",
+                                    "red": 255, "green": 0, "blue": 0, "brightness": 80, "time": 2}},
+    {"type": "SetFlow", "payload": {"id": 1, "pkt_num": 1, "cmd": "Set", "rgb_mode": "Temperature",
+                                    "temperature": 2700, "brightness": 40, "time": 3}},
+    {"type": "SetFlow", "payload": {"id": 1, "cmd": "Start"}},
+    {"type": "SetSimpleFlow", "payload": {"id": 2, "type": "Color", "time": 10,
+                                          "first": {"red": 255}, "second": {"blue": 255}}},
+    {"type": "Pair"},
+]
+# requests without payload
+REQUESTS += [{"type": name} for name in RequestType.encmapping
+             if name not in {query["type"] for query in REQUESTS}]
+
+RESPONSES = [bytes.fromhex(x) for x in [
+    "434502010000000000640000000000000000",  # StateResult, color
+    "434501020000000000640f8f150000000000",  # StateResult, white
+    "4349010730000100000001030001",  # AlarmResult
+    "4349020630000306000001040101",  # AlarmResult, weekdays
+    "4349ff000000000000000000000000000000",  # AlarmResult, end of list
+    "435001000752656164696e67",  # SceneResult
+    "437101140000060000000000000000000000",  # NightModeResult
+    "4381011e0106fc",  # SleepTimerResult
+    "435d01000100020003000400000000000000",  # VersionResult
+    "435f0102030405060708090a0b0c00000000",  # SerialNumberResult
+    "4362305914120310190000000000000000",  # TimeResult
+    "437301010a00ff000000ff000000ff00ff00",  # SimpleFlowResult
+    "436302000000000000000000000000000000",  # PairingResult
+    "435301000d5965656c696768742042656473",  # GetNameResult
+    "435b00000000000000000000000000000000",  # GradualResult, no payload
+]]
+RESPONSES = [(x + bytes(18))[:18] for x in RESPONSES]
+
+
+def check_equivalence(reference, codec):
+    for query in REQUESTS:
+        ref = reference.build_request(query)
+        res = codec.build_request(query)
+        if ref != res:
+            raise AssertionError("%s: %s != %s" % (query, ref.hex(), res.hex()))
+
+    for frame in RESPONSES:
+        ref = reference.parse_response(frame)
+        res = codec.parse_response(frame)
+        if ref != res:
+            raise AssertionError("%s: %s != %s" % (frame.hex(), ref, res))
+
+
+def bench(codec, number):
+    def run():
+        for query in REQUESTS:
+            codec.build_request(query)
+        for frame in RESPONSES:
+            codec.parse_response(frame)
+
+    elapsed = min(timeit.repeat(run, number=number, repeat=3))
+    frames = (len(REQUESTS) + len(RESPONSES)) * number
+    return frames / elapsed
+
+
+def bench_template(number):
+    template = FrameTemplate("SetColor", ">BBBBB")
+
+    def run():
+        for level in range(100):
+            template.fill(255, 0, level, 0, level)
+
+    elapsed = min(timeit.repeat(run, number=number, repeat=3))
+    return 100 * number / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=200)
+    args = parser.parse_args()
+
+    reference = ConstructCodec()
+    fast = FastCodec()
+    check_equivalence(reference, fast)
+    print("%s requests and %s responses are equivalent" % (len(REQUESTS), len(RESPONSES)))
+
+    results = {}
+    for codec in (reference, fast):
+        results[codec.name] = bench(codec, args.number)
+        print("%-10s %10.0f frames/s" % (codec.name, results[codec.name]))
+
+    print("speedup    %10.1fx" % (results["fast"] / results["construct"]))
+    print("SetColor template fill %10.0f frames/s" % bench_template(args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Checks what importing the library and starting the CLI costs.
+
+    python benchmarks/bench_startup.py [--repeat N]
+
+Every scenario runs in a fresh interpreter with -X importtime. It fails
+when a scenario imports a module it must not need, or when its imports take
+longer than the budget in milliseconds. Budgets are generous upper bounds
+meant to catch eager imports, not to measure a particular machine.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name, code, modules which must not be imported, budget in ms
+SCENARIOS = [
+    ("import yeelightbt", "import yeelightbt",
+     ["bluepy", "construct", "asyncio", "click"], 30),
+    ("retry and metrics", "import yeelightbt.retry, yeelightbt.metrics",
+     ["bluepy", "construct", "asyncio"], 60),
+    ("cli --help",
+     "import sys; sys.argv = ['yeelightbt', '--help']\n"
+     "from yeelightbt.cli import cli\n"
+     "try:\n    cli()\nexcept SystemExit:\n    pass",
+     ["bluepy", "construct", "asyncio"], 150),
+    ("create a Lamp", "from yeelightbt import Lamp; Lamp('f8:24:41:00:00:01')",
+     ["bluepy", "asyncio"], 200),
+]
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run(code):
+    """Returns the imported modules and the total import time in ms."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [ROOT] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    modules = set()
+    total = 0
+    for line in proc.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, _, indent, module = match.groups()
+        modules.add(module)
+        total += int(self_us)
+    return modules, total / 1000
+
+
+def unexpected_modules(modules, forbidden):
+    """Returns the forbidden modules (or their submodules) imported."""
+    return sorted(module for module in forbidden
+                  if any(m == module or m.startswith(module + ".")
+                         for m in modules))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scenario, the fastest counts")
+    args = parser.parse_args()
+
+    failed = False
+    print("%-20s %10s %10s  %s" % ("scenario", "ms", "budget", "unexpected"))
+    for name, code, forbidden, budget in SCENARIOS:
+        runs = [run(code) for _ in range(args.repeat)]
+        modules = runs[0][0]
+        elapsed = min(total for _, total in runs)
+        unexpected = unexpected_modules(modules, forbidden)
+        ok = elapsed <= budget and not unexpected
+        failed = failed or not ok
+        print("%-20s %10.1f %10s  %s%s" % (name, elapsed, budget,
+                                           ", ".join(unexpected) or "-",
+                                           "" if ok else "  FAIL"))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Benchmarks of the codec, the command path and the notification dispatch.
+
+    python benchmarks/bench_suite.py [-k FILTER] [--save] [--check] [--threshold 0.4]
+
+Runs without bluetooth hardware; bluepy is replaced by a stub if it is not
+installed, and commands go to a simulated lamp without latency. For each
+case the best of three runs is reported in operations per second, along
+with the peak of temporary memory allocated by a single operation.
+
+--save stores the results as the new baselines, --check fails if any case
+got slower than its baseline by more than the threshold. The baselines
+depend on the machine, save them again before checking on another one.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "baselines.json")
+
+
+def _stub_bluepy():
+    try:
+        import bluepy.btle  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    btle = types.ModuleType("bluepy.btle")
+
+    class BTLEException(Exception):
+        pass
+
+    class DefaultDelegate:
+        def __init__(self):
+            pass
+
+    class Peripheral:
+        def withDelegate(self, delegate):
+            self.delegate = delegate
+
+    btle.BTLEException = BTLEException
+    btle.DefaultDelegate = DefaultDelegate
+    btle.Peripheral = Peripheral
+    btle.Scanner = object
+    btle.Debugging = False
+    bluepy = types.ModuleType("bluepy")
+    bluepy.btle = btle
+    sys.modules["bluepy"] = bluepy
+    sys.modules["bluepy.btle"] = btle
+
+
+sys.path.insert(0, ROOT)
+_stub_bluepy()
+
+from bench_codec import REQUESTS, RESPONSES  # noqa: E402
+from yeelightbt.codec import ConstructCodec, FastCodec, FRAME_SIZE, HEADER  # noqa: E402
+from yeelightbt.lamp import Lamp  # noqa: E402
+from yeelightbt.simulator import Simulator  # noqa: E402
+from yeelightbt.structures import Request, Response, ResponseType  # noqa: E402
+
+
+def _requests_with_payload():
+    seen = set()
+    for query in REQUESTS:
+        if "payload" in query and query["type"] not in seen:
+            seen.add(query["type"])
+            yield query
+
+
+def _response_per_type():
+    """One sample frame for every ResponseType, zeroed if there is none."""
+    samples = {}
+    for frame in RESPONSES:
+        type_ = str(Response.parse(frame).type)
+        samples.setdefault(type_, frame)
+    for name, value in ResponseType.encmapping.items():
+        if name not in samples:
+            samples[name] = bytes([HEADER, value]) + bytes(FRAME_SIZE - 2)
+    return sorted(samples.items())
+
+
+def cases():
+    """Returns a list of (name, function running one operation)."""
+    res = []
+    codecs = [ConstructCodec(), FastCodec()]
+
+    for query in _requests_with_payload():
+        res.append(("build/Request/%s" % query["type"],
+                    lambda query=query: Request.build(query)))
+        for codec in codecs:
+            res.append(("build/%s/%s" % (codec.name, query["type"]),
+                        lambda codec=codec, query=query: codec.build_request(query)))
+
+    for type_, frame in _response_per_type():
+        res.append(("parse/Response/%s" % type_,
+                    lambda frame=frame: Response.parse(frame)))
+        for codec in codecs:
+            res.append(("parse/%s/%s" % (codec.name, type_),
+                        lambda codec=codec, frame=frame: codec.parse_response(frame)))
+
+    sim = Simulator()
+    lamp = Lamp("f8:24:41:00:00:01", transport=sim, handle_cache=None)
+    lamp.connect()
+    lamp.state()
+    res += [
+        ("cmd/turn_on", lamp.turn_on),
+        ("cmd/set_brightness", lambda: lamp.set_brightness(50)),
+        ("cmd/set_color", lambda: lamp.set_color(255, 0, 0, 50)),
+        ("cmd/state", lamp.state),
+        ("cmd/state_cached", lambda: lamp.state(max_age=3600)),
+    ]
+
+    state = sim.get_lamp(lamp.mac).state_frame()
+    res.append(("notification/StateResult",
+                lambda: lamp.handle_notification(state)))
+    return res
+
+
+def measure(func):
+    """Returns operations per second and peak temporary bytes per operation."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    elapsed = min(timer.repeat(repeat=3, number=number))
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(20):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return number / elapsed, sum(peaks) / len(peaks)
+
+
+def check(results, baselines, threshold):
+    """Returns the cases slower than their baseline by more than threshold."""
+    slower = []
+    for name, ops in sorted(results.items()):
+        baseline = baselines.get(name)
+        if baseline and ops < baseline * (1 - threshold):
+            slower.append((name, ops, baseline))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", "--filter", default="",
+                        help="only run the cases containing this")
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as baselines")
+    parser.add_argument("--check", action="store_true",
+                        help="fail on regressions against the baselines")
+    parser.add_argument("--threshold", type=float, default=0.4,
+                        help="allowed slowdown for --check, 0.4 is 40%%")
+    parser.add_argument("--baselines", default=BASELINES)
+    args = parser.parse_args()
+
+    try:
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    results = {}
+    print("%-40s %12s %10s %10s" % ("case", "ops/s", "B/op", "baseline"))
+    for name, func in cases():
+        if args.filter not in name:
+            continue
+        ops, allocated = measure(func)
+        results[name] = ops
+        baseline = baselines.get(name)
+        print("%-40s %12.0f %10.0f %10s" % (
+            name, ops, allocated,
+            "%+.0f%%" % (100 * (ops / baseline - 1)) if baseline else "-"))
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump({name: round(ops) for name, ops in sorted(baselines.items())},
+                      f, indent=2)
+            f.write("\n")
+        print("Saved %s baselines to %s" % (len(results), args.baselines))
+
+    if args.check:
+        slower = check(results, baselines, args.threshold)
+        for name, ops, baseline in slower:
+            print("REGRESSION %s: %.0f ops/s, baseline %.0f" % (name, ops, baseline))
+        if slower:
+            sys.exit(1)
+        print("No regressions beyond %.0f%%" % (100 * args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,9 @@ based on demo & yeelight components.
 Author: Teemu Rytilahti <tpr@iki.fi>
 """
 
+import functools
 import logging
+from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
 
@@ -19,12 +21,20 @@ from homeassistant.components.light import (
     SUPPORT_COLOR_TEMP, SUPPORT_EFFECT, SUPPORT_COLOR, SUPPORT_WHITE_VALUE,
     Light, PLATFORM_SCHEMA)
 
+from homeassistant.helpers.event import async_track_time_interval
+
 from homeassistant.util.color import (
     color_temperature_mired_to_kelvin as mired_to_kelvin,
     color_temperature_kelvin_to_mired as kelvin_to_mired,
     color_temperature_to_rgb)
 
 CONF_KEEP_ALIVE = "keep_alive"
+CONF_HEALTH_CHECK_INTERVAL = "health_check_interval"
+
+# max. age in seconds of the state used to skip writes not changing it
+SUPPRESS_UNCHANGED = 10
+# the lamp is only asked for its state when it has not notified for this long
+DEFAULT_HEALTH_CHECK_INTERVAL = timedelta(minutes=5)
 
 
 DEVICE_SCHEMA = vol.Schema({
@@ -34,6 +44,8 @@ DEVICE_SCHEMA = vol.Schema({
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_DEVICES):
         vol.Schema({cv.string: DEVICE_SCHEMA}),
+    vol.Optional(CONF_HEALTH_CHECK_INTERVAL,
+                 default=DEFAULT_HEALTH_CHECK_INTERVAL): cv.time_period,
 })
 
 LIGHT_EFFECT_LIST = ['flow', 'none']
@@ -45,28 +57,35 @@ SUPPORT_YEELIGHTBT = (SUPPORT_BRIGHTNESS | SUPPORT_COLOR_TEMP |
 _LOGGER = logging.getLogger(__name__)
 
 
-def setup_platform(hass, config, add_devices_callback, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities,
+                               discovery_info=None):
     """Setup the yeelightbt light platform."""
     lights = []
+    interval = config.get(CONF_HEALTH_CHECK_INTERVAL,
+                          DEFAULT_HEALTH_CHECK_INTERVAL)
     if discovery_info is not None:
         _LOGGER.debug("Adding autodetected %s", discovery_info['hostname'])
 
-        lights.append(YeelightBT(discovery_info[CONF_MAC], DEVICE_SCHEMA({})))
+        lights.append(YeelightBT(discovery_info[CONF_MAC], DEVICE_SCHEMA({}),
+                                 interval))
     else:
         for name, device_cfg in config[CONF_DEVICES].items():
             mac = device_cfg[CONF_MAC]
-            lights.append(YeelightBT(name, mac))
+            lights.append(YeelightBT(name, mac, interval))
 
-    add_devices_callback(lights, True)  # request an update before adding
+    # added right away as unavailable, becoming available once connected
+    async_add_entities(lights)
 
 
 class YeelightBT(Light):
     """Represenation of a demo light."""
 
-    def __init__(self, name, mac):
+    def __init__(self, name, mac, health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL):
         """Initialize the light."""
         self._name = name
         self._mac = mac
+        self._health_check_interval = health_check_interval
+        self._remove_health_check = None
         self._state = None
         self._rgb = None
         self._ct = None
@@ -83,8 +102,32 @@ class YeelightBT(Light):
 
     @property
     def should_poll(self):
-        """No polling needed for a demo light."""
-        return True
+        """The lamp notifies all changes, see _health_check for the rest."""
+        return False
+
+    async def async_added_to_hass(self):
+        self._remove_health_check = async_track_time_interval(
+            self.hass, self._health_check, self._health_check_interval)
+        # only now self.hass is set, which the connect relies on
+        self.hass.async_create_task(self.async_connect())
+
+    async def async_will_remove_from_hass(self):
+        if self._remove_health_check is not None:
+            self._remove_health_check()
+            self._remove_health_check = None
+
+    async def _health_check(self, now):
+        """Asks the lamp for its state if it has not notified for a while."""
+        available = self._available
+        await self.async_update()
+        if self._available != available:
+            self.async_schedule_update_ha_state()
+
+    async def async_connect(self):
+        """Connects in the background, the state notification follows."""
+        await self.async_update()
+        if not self._available:
+            self.async_schedule_update_ha_state()
 
     @property
     def name(self):
@@ -131,7 +174,9 @@ class YeelightBT(Light):
         from yeelightbt import Lamp
         if not self.__dev:
             _LOGGER.error("Initializing %s", self._mac)
-            self.__dev = Lamp(self._mac, self._status_cb, keep_connection=True)
+            # automations often repeat the current state
+            self.__dev = Lamp(self._mac, self._status_cb, keep_connection=True,
+                              suppress_unchanged=SUPPRESS_UNCHANGED)
 
         return self.__dev
 
@@ -155,45 +200,56 @@ class YeelightBT(Light):
         _LOGGER.debug("available: %s state: %s rgb: %s ct: %s",
                       self._available, self._state, self._rgb, self._ct)
 
-        self.schedule_update_ha_state()
+        if self.hass is not None:
+            self.schedule_update_ha_state()
+
+    async def async_update(self):
+        # the lamp is used from executor threads only, serialized by its lock
+        await self.hass.async_add_executor_job(self._update)
 
-    def update(self):
+    def _update(self):
         # Note, update should only start fetching,
         # followed by asynchronous updates through notifications.
-        with self._dev:
-            self._dev.state()
-
-    def turn_on(self, **kwargs):
+        max_age = self._health_check_interval.total_seconds()
+        try:
+            with self._dev:
+                if self._dev.state(max_age=max_age) is None:
+                    self._available = False
+        except Exception as ex:
+            _LOGGER.warning("Unable to update %s: %s", self._mac, ex)
+            self._available = False
+
+    async def async_turn_on(self, **kwargs):
         """Turn the light on."""
         self._state = True
-        with self._dev:
-            if ATTR_RGB_COLOR in kwargs:
-                rgb = kwargs[ATTR_RGB_COLOR]
-                self._rgb = rgb
-                self._dev.set_color(rgb[0], rgb[1], rgb[2])
-
-            if ATTR_COLOR_TEMP in kwargs:
-                mireds = kwargs[ATTR_COLOR_TEMP]
-                temp_in_k = mired_to_kelvin(mireds)
-                self._dev.set_temperature(int(temp_in_k))
-                self._ct = mireds
-
-            if ATTR_BRIGHTNESS in kwargs:
-                brightness = kwargs[ATTR_BRIGHTNESS]
-                self._dev.set_brightness(int(brightness / 255 * 100))
-                self._brightness = brightness
-
-            # if we are just started without parameters, turn on.
-            if ATTR_RGB_COLOR not in kwargs and \
-               ATTR_COLOR_TEMP not in kwargs and \
-               ATTR_BRIGHTNESS not in kwargs:
-                self._dev.turn_on()
+        rgb = temperature = brightness = None
+        if ATTR_RGB_COLOR in kwargs:
+            rgb = kwargs[ATTR_RGB_COLOR]
+            self._rgb = rgb
+
+        if ATTR_COLOR_TEMP in kwargs:
+            mireds = kwargs[ATTR_COLOR_TEMP]
+            temperature = int(mired_to_kelvin(mireds))
+            self._ct = mireds
+
+        if ATTR_BRIGHTNESS in kwargs:
+            brightness = int(kwargs[ATTR_BRIGHTNESS] / 255 * 100)
+            self._brightness = kwargs[ATTR_BRIGHTNESS]
+
+        # a single write in most cases, turns on without parameters
+        await self.hass.async_add_executor_job(functools.partial(
+            self._apply, on=True, rgb=rgb, temperature=temperature,
+            brightness=brightness))
 
         # if ATTR_EFFECT in kwargs:
         #    self._effect = kwargs[ATTR_EFFECT]
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Turn the light off."""
+        await self.hass.async_add_executor_job(
+            functools.partial(self._apply, on=False))
+        self._state = False
+
+    def _apply(self, **state):
         with self._dev:
-            self._dev.turn_off()
-            self._state = False
+            self._dev.apply(**state)
@@ -25,7 +25,7 @@ setup(
 
     packages=["yeelightbt"],
 
-    python_requires='>=3.4',
+    python_requires='>=3.7',
     install_requires=['bluepy', 'construct', 'click'],
     entry_points={
         'console_scripts': [
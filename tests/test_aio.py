@@ -0,0 +1,31 @@
+"""AsyncLamp against the simulated transport."""
+import asyncio
+
+from yeelightbt.aio import AsyncLamp
+from yeelightbt.simulator import Simulator
+
+MAC = "f8:24:41:00:00:01"
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_streams_do_not_block_the_loop():
+    simulator = Simulator(latency=0.01)
+    simulated = simulator.get_lamp(MAC)
+
+    async def main():
+        async with AsyncLamp(MAC, transport=simulator, handle_cache=None) as lamp:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            name = await lamp.read_name()
+            alarms = [alarm async for alarm in lamp.iter_alarms()]
+            scenes = [scene async for scene in lamp.iter_scenes()]
+            return name, alarms, scenes, loop.time() - start
+
+    name, alarms, scenes, elapsed = _run(main())
+    assert name == simulated.name
+    assert [alarm.id for alarm in alarms] == sorted(simulated.alarms)
+    assert [scene.scene_id for scene in scenes] == sorted(simulated.scenes)
+    assert elapsed < 1
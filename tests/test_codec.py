@@ -0,0 +1,122 @@
+"""FastCodec has to build and parse exactly like the construct definitions."""
+import random
+
+import pytest
+
+from yeelightbt.codec import FRAME_SIZE, HEADER, ConstructCodec, FastCodec
+from yeelightbt.structures import RequestType, ResponseType
+
+REFERENCE = ConstructCodec()
+FAST = FastCodec()
+
+PAYLOADS = {
+    "SetOnOff": [{"state": True}, {"state": False}, {"state": 3}],
+    "SetColor": [{"red": 255, "green": 10, "blue": 0, "brightness": 50},
+                 {"red": 1, "green": 2, "blue": 3, "white": 4, "brightness": 5},
+                 {"red": 255}, {"red": 256}, {"red": -1}],
+    "SetBrightness": [{"brightness": 80}, {"brightness": 0}, {"brightness": 300}, {}],
+    "SetTemperature": [{"temperature": 2700, "brightness": 40},
+                       {"temperature": 6500}, {"temperature": 70000}, {}],
+    "Pair": [{}, {"devid": b"\x01" * 16}, {"devid": 0x1234}, {"devid": b"short"}],
+    "GetAlarm": [{"id": 255}, {"id": 1}, {"id": 256}, {}],
+    "GetScene": [{"id": 1}, {}],
+    "GetSimpleFlow": [{"id": 255}, {}],
+    "SetScene": [{"scene_id": 1, "text": "Reading"},
+                 {"scene_id": 2, "idx": 1, "text": "x" * 13},
+                 {"scene_id": 2, "text": "x" * 14},
+                 {"scene_id": 1, "text": "ä"}],
+    "SetFlow": [{"id": 1, "pkt_num": 0, "cmd": "Set", "rgb_mode": "Color",
+                 "red": 255, "brightness": 80, "time": 2},
+                {"id": 1, "pkt_num": 1, "cmd": "Set", "rgb_mode": "Temperature",
+                 "temperature": 2700, "brightness": 40, "time": 600},
+                {"id": 1, "cmd": "Start"}, {"id": 1, "cmd": "Stop"},
+                {"id": 1, "cmd": "Store", "rgb_mode": 2},
+                {"id": 1, "cmd": "Unknown"}, {"id": 1}],
+    "SetSimpleFlow": [{"id": 2, "type": "Color", "time": 10,
+                       "first": {"red": 255}, "second": {"blue": 255}},
+                      {"id": 2, "type": "Temperature", "time": 255, "control": 1},
+                      {"id": 2, "type": "Color", "time": 256}],
+}
+
+RESPONSES = [bytes.fromhex(x) for x in [
+    "434502010000000000640000000000000000",  # StateResult, color
+    "434501020000000000640f8f150000000000",  # StateResult, white
+    "4349010730000100000001030001",  # AlarmResult
+    "4349020630000306000001040101",  # AlarmResult, weekdays
+    "4349ff000000000000000000000000000000",  # AlarmResult, end of list
+    "435001000752656164696e67",  # SceneResult
+    "437101140000060000000000000000000000",  # NightModeResult
+    "4381011e0106fc",  # SleepTimerResult
+    "435d01000100020003000400000000000000",  # VersionResult
+    "435f0102030405060708090a0b0c00000000",  # SerialNumberResult
+    "4362305914120310190000000000000000",  # TimeResult
+    "437301010a00ff000000ff000000ff00ff00",  # SimpleFlowResult
+    "436302000000000000000000000000000000",  # PairingResult
+    "435301000d5965656c696768742042656473",  # GetNameResult
+]]
+
+
+def _outcome(func, *args):
+    """Returns the result, or the type of the raised exception."""
+    try:
+        return func(*args)
+    except Exception as ex:
+        return type(ex)
+
+
+def _requests():
+    for name in RequestType.encmapping:
+        yield {"type": name}
+        for payload in PAYLOADS.get(name, []):
+            yield {"type": name, "payload": payload}
+
+
+def _frames(type_, count=20):
+    """Zeroed, saturated and random frames of the given response type."""
+    rand = random.Random(type_)
+    value = ResponseType.encmapping[type_]
+    yield bytes([HEADER, value]) + bytes(FRAME_SIZE - 2)
+    yield bytes([HEADER, value]) + b"\xff" * (FRAME_SIZE - 2)
+    for _ in range(count):
+        yield bytes([HEADER, value]) + bytes(rand.getrandbits(8)
+                                             for _ in range(FRAME_SIZE - 2))
+
+
+@pytest.mark.parametrize("query", list(_requests()),
+                         ids=lambda query: "%s-%s" % (query["type"], query.get("payload")))
+def test_requests(query):
+    assert _outcome(FAST.build_request, query) == _outcome(REFERENCE.build_request, query)
+
+
+@pytest.mark.parametrize("type_", list(RequestType.encmapping))
+def test_constant_requests(type_):
+    assert (_outcome(FAST.constant_request, type_) ==
+            _outcome(REFERENCE.constant_request, type_))
+
+
+@pytest.mark.parametrize("type_", list(ResponseType.encmapping))
+def test_responses(type_):
+    for frame in _frames(type_):
+        assert (_outcome(FAST.parse_response, frame) ==
+                _outcome(REFERENCE.parse_response, frame)), frame.hex()
+
+
+@pytest.mark.parametrize("frame", [(x + bytes(FRAME_SIZE))[:FRAME_SIZE] for x in RESPONSES],
+                         ids=lambda frame: frame.hex())
+def test_captured_responses(frame):
+    res = FAST.parse_response(frame)
+    assert res == REFERENCE.parse_response(frame)
+    assert res.payload is not None
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    bytes([HEADER]),
+    bytes(FRAME_SIZE),  # wrong header
+    bytes([HEADER, 0x00]) + bytes(FRAME_SIZE - 2),  # unknown type
+    bytes([HEADER, 0x45, 0x01, 0x02]),  # short StateResult
+    bytes([HEADER, 0x53, 0x01, 0x00, 0x20]) + bytes(FRAME_SIZE - 5),  # name too long
+    bytes([HEADER, 0x50, 0x01, 0x00, 0x02, 0xff, 0xfe]) + bytes(FRAME_SIZE - 7),  # not ascii
+], ids=lambda frame: frame.hex() or "empty")
+def test_invalid_responses(frame):
+    assert _outcome(FAST.parse_response, frame) == _outcome(REFERENCE.parse_response, frame)
@@ -0,0 +1,52 @@
+"""Daemon and its client against the simulated transport."""
+import os
+import threading
+import time
+
+import pytest
+
+from yeelightbt import daemon
+from yeelightbt.lamp import Lamp
+from yeelightbt.simulator import Simulator
+
+MAC = "f8:24:41:00:00:01"
+
+
+def _until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server(tmp_path):
+    simulator = Simulator(latency=0.01)
+    path = os.path.join(str(tmp_path), "yeelightbt.sock")
+    server = daemon.Daemon(path, lambda mac: Lamp(
+        mac, keep_connection=True, transport=simulator, handle_cache=None))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _until(lambda: daemon.is_running(path))
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def test_wait_for_notifications_streams_states(server):
+    states = []
+    lamp = daemon.RemoteLamp(MAC, daemon.Client(server.path), states.append)
+    other = daemon.RemoteLamp(MAC, daemon.Client(server.path))
+
+    def _watch():
+        try:
+            lamp.wait_for_notifications()
+        except daemon.DaemonError:
+            pass  # closed at the end of the test
+
+    threading.Thread(target=_watch, daemon=True).start()
+    _until(lambda: states)
+    other.set_brightness(42)
+    _until(lambda: lamp.brightness == 42)
+    assert "brightness(42)" in str(states[-1])
+
@@ -0,0 +1,59 @@
+"""Lamp against the simulated transport."""
+import pytest
+
+from yeelightbt.handlecache import HandleCache
+from yeelightbt.lamp import Lamp
+from yeelightbt.simulator import (CONTROL_HANDLE, NOTIFY_HANDLE,
+                                  REGISTER_NOTIFY_HANDLE, Simulator)
+
+MAC = "f8:24:41:00:00:01"
+
+
+@pytest.fixture
+def simulator():
+    return Simulator()
+
+
+def _lamp(simulator, **kwargs):
+    kwargs.setdefault("keep_connection", True)
+    return Lamp(MAC, transport=simulator, **kwargs)
+
+
+def test_stale_cached_handles_are_rediscovered(simulator):
+    cache = HandleCache()
+    cache.set(MAC, 0x30, 0x31, 0x32)
+    lamp = _lamp(simulator, handle_cache=cache)
+    lamp.connect()
+
+    assert cache.get(MAC) == {"notify": NOTIFY_HANDLE, "control": CONTROL_HANDLE,
+                              "cccd": REGISTER_NOTIFY_HANDLE}
+    lamp.set_brightness(42)
+    assert simulator.lamps[MAC].brightness == 42
+
+
+def test_no_suppression_while_changes_are_unreported(simulator, monkeypatch):
+    lamp = _lamp(simulator, suppress_unchanged=60)
+    lamp.connect()
+    lamp.state()
+
+    # the states reported for the writes are still in flight
+    in_flight = []
+    monkeypatch.setattr(lamp._conn, "_notify", in_flight.append)
+    lamp.set_brightness(10)
+    lamp.set_brightness(50)
+    lamp.handle_notification(in_flight[0])
+    assert lamp.brightness == 10
+    lamp.set_brightness(10)
+
+    assert lamp.suppressed_writes == 0
+    assert simulator.lamps[MAC].brightness == 10
+
+
+def test_suppression_once_all_changes_are_reported(simulator):
+    lamp = _lamp(simulator, suppress_unchanged=60)
+    lamp.connect()
+    lamp.set_brightness(10)
+    lamp.state()
+
+    lamp.set_brightness(10)
+    assert lamp.suppressed_writes == 1
@@ -0,0 +1,47 @@
+"""ConnectionPool with lamps of the simulated transport."""
+import threading
+
+from yeelightbt.lamp import Lamp
+from yeelightbt.pool import ConnectionPool
+from yeelightbt.simulator import Simulator
+
+
+def test_disconnecting_does_not_block_the_pool():
+    simulator = Simulator()
+    pool = ConnectionPool(max_connections=1, idle_timeout=0)
+    first = Lamp("f8:24:41:00:00:01", transport=simulator, pool=pool)
+    second = Lamp("f8:24:41:00:00:02", transport=simulator, pool=pool)
+    with first:
+        first.turn_on()
+
+    disconnecting, done = threading.Event(), threading.Event()
+    disconnect = first.disconnect
+
+    def _slow_disconnect():
+        disconnecting.set()
+        assert done.wait(5)
+        disconnect()
+
+    first.disconnect = _slow_disconnect
+    expiring = threading.Thread(target=pool.expire)
+    expiring.start()
+    assert disconnecting.wait(5)
+
+    # the pool is usable meanwhile, but the slot is not free yet
+    assert pool.stats["connected"] == 0
+    connected = threading.Event()
+
+    def _use_second():
+        with second:
+            connected.set()
+
+    using = threading.Thread(target=_use_second)
+    using.start()
+    assert not connected.wait(0.1)
+
+    done.set()
+    expiring.join()
+    using.join()
+    assert connected.is_set()
+    assert not first.connected
+    assert pool.stats["expirations"] == 1
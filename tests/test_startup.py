@@ -0,0 +1,27 @@
+"""Modules the scenarios of benchmarks/bench_startup.py must not import.
+
+The import time budgets are only checked by the script itself."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks"))
+
+import bench_startup  # noqa: E402
+
+
+@pytest.mark.parametrize("name, code, forbidden", [
+    scenario[:3] for scenario in bench_startup.SCENARIOS],
+    ids=[scenario[0] for scenario in bench_startup.SCENARIOS])
+def test_no_forbidden_imports(name, code, forbidden):
+    modules, _ = bench_startup.run(code)
+    assert bench_startup.unexpected_modules(modules, forbidden) == []
+
+
+def test_forbidden_submodules_are_found():
+    modules = {"yeelightbt", "construct.core"}
+    assert bench_startup.unexpected_modules(
+        modules, ["bluepy", "construct"]) == ["construct"]
+    assert bench_startup.unexpected_modules({"constructs"}, ["construct"]) == []
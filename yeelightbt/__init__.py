@@ -1,3 +1,33 @@
 # flake8: noqa
-from .lamp import Lamp
-from .structures import LampMode
+"""
+Python library for the Yeelight bedside lamp and Candela.
+
+The names below are imported on first access, so that importing the
+package does not load construct, bluepy or asyncio before they are needed.
+"""
+import importlib
+
+_LAZY = {
+    "Lamp": ".lamp",
+    "FlowStep": ".lamp",
+    "AsyncLamp": ".aio",
+    "TransitionEngine": ".transition",
+    "RetryPolicy": ".retry",
+    "CircuitBreaker": ".retry",
+    "CircuitOpen": ".retry",
+    "LampMode": ".structures",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
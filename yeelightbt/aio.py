@@ -0,0 +1,236 @@
+"""
+asyncio interface for the lamps.
+
+    async with AsyncLamp("f8:24:41:xx:xx:xx") as lamp:
+        await lamp.set_color(255, 0, 0, 50)
+        print(await lamp.state())
+        print(await lamp.read_name(), [a async for a in lamp.iter_alarms()])
+        async for notification in lamp.notifications():
+            print(notification)
+
+Requests and responses are the same as with Lamp, but instead of blocking
+in a wait loop, responses resolve futures on the event loop. Notifications
+are pushed by the transport if it supports that (see
+connection.BTLEConnection), or polled from the event loop otherwise.
+Only the writes themselves are handed to the default executor.
+"""
+import asyncio
+import functools
+import logging
+
+from .lamp import (END_OF_LIST, Lamp, _Cached, _is_last_name_part, _list_end,
+                   _prepare)
+
+_LOGGER = logging.getLogger(__name__)
+
+# methods of Lamp which would block the event loop, see notifications()
+_BLOCKING = {"wait", "wait_for_notifications"}
+
+
+class AsyncLamp:
+    """Awaitable version of Lamp, accepting the same arguments."""
+
+    def __init__(self, mac, *args, poll_interval=0.01, **kwargs):
+        self._lamp = Lamp(mac, *args, **kwargs)
+        self._poll_interval = poll_interval
+        self._loop = None
+        self._conn = None
+        self._io_lock = None
+        self._poller = None
+        self._futures = {}
+        self._subscribers = set()
+
+    def __getattr__(self, name):
+        # mac, is_on, mode, color, brightness, temperature, ...
+        if name in _BLOCKING:
+            raise AttributeError("%s would block the event loop, use "
+                                 "notifications() instead" % name)
+        return getattr(self._lamp, name)
+
+    def __str__(self):
+        return str(self._lamp)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def connect(self):
+        """Connects and pairs, the setup itself runs in an executor."""
+        self._loop = asyncio.get_event_loop()
+        self._io_lock = asyncio.Lock()
+        await self._loop.run_in_executor(None, self._lamp.connect)
+
+        self._conn = self._lamp._conn
+        self._conn.set_callback(self._lamp.notify_handle, self._on_notification)
+        if not self._conn.pushes_notifications:
+            self._poller = self._loop.create_task(self._poll())
+
+    async def disconnect(self):
+        if self._conn is None:
+            return
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+        conn, self._conn = self._conn, None
+        async with self._io_lock:
+            await self._loop.run_in_executor(None, conn.disconnect)
+
+    async def _poll(self):
+        while True:
+            async with self._io_lock:
+                self._conn.poll()
+            await asyncio.sleep(self._poll_interval)
+
+    def _on_notification(self, data):
+        # called from the executor during writes
+        self._loop.call_soon_threadsafe(self._handle_notification, data)
+
+    def _handle_notification(self, data):
+        res = self._lamp.handle_notification(data)
+        for future in self._futures.pop(res.type, []):
+            if not future.done():
+                future.set_result(res.payload)
+        for queue in self._subscribers:
+            queue.put_nowait(res)
+
+    async def notifications(self):
+        """Yields all parsed notifications as they arrive."""
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.discard(queue)
+
+    async def _write(self, frame):
+        write = functools.partial(self._conn.make_request,
+                                  self._lamp.control_handle, frame,
+                                  with_response=True)
+        async with self._io_lock:
+            # the executor is reading the responses meanwhile
+            return await self._loop.run_in_executor(None, write)
+
+    async def _timed_write(self, req, frame, started=False):
+        """Writes and records the write time, returns the result of the
+        write or with started the time the write was started."""
+        start = self._loop.time()
+        res = await self._write(frame)
+        self._lamp._count("writes", req)
+        self._lamp._observe("write_seconds", req, self._loop.time() - start)
+        return start if started else res
+
+    async def _command(self, req):
+        if req is None:
+            return None
+        if isinstance(req, _Cached):
+            return req.value
+        req, query, request_bytes, wait, expected = _prepare(self._lamp, req)
+
+        _LOGGER.debug(">> %s (wait: %s, expecting: %s)", query, wait, expected)
+        if not expected:
+            res = await self._timed_write(req, request_bytes)
+            if wait:
+                await asyncio.sleep(wait)
+            return res
+
+        future = self._loop.create_future()
+        self._futures.setdefault(expected, []).append(future)
+        try:
+            start = await self._timed_write(req, request_bytes, started=True)
+            res = await asyncio.wait_for(future, self._lamp._response_timeout)
+            self._lamp._observe("response_seconds", req, self._loop.time() - start)
+            return res
+        except asyncio.TimeoutError:
+            _LOGGER.warning("No %s received for %s in %s seconds",
+                            expected, query, self._lamp._response_timeout)
+            return None
+        finally:
+            waiting = self._futures.get(expected, [])
+            if future in waiting:
+                waiting.remove(future)
+
+    async def _stream(self, req, is_last):
+        """See Lamp._stream()."""
+        req, query, request_bytes, wait, expected = _prepare(self._lamp, req)
+
+        _LOGGER.debug(">> %s (streaming %s)", query, expected)
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            start = await self._timed_write(req, request_bytes, started=True)
+            first = True
+            while True:
+                try:
+                    res = await asyncio.wait_for(queue.get(),
+                                                 self._lamp._response_timeout)
+                except asyncio.TimeoutError:
+                    _LOGGER.warning("No further %s received for %s in %s seconds",
+                                    expected, query, self._lamp._response_timeout)
+                    return
+                if res.type != expected:
+                    continue
+                if first:
+                    self._lamp._observe("response_seconds", req,
+                                        self._loop.time() - start)
+                    first = False
+                yield res.payload
+                if is_last(res.payload):
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+    async def _iter_list(self, req, number, id_field="id"):
+        async for res in self._stream(req, _list_end(number, id_field)):
+            if res[id_field] != END_OF_LIST:
+                yield res
+
+    def iter_alarms(self, number=END_OF_LIST):
+        """See Lamp.iter_alarms()."""
+        return self._iter_list(Lamp.get_alarm.builder(self._lamp, number), number)
+
+    def iter_scenes(self, number=END_OF_LIST):
+        """See Lamp.iter_scenes()."""
+        return self._iter_list(Lamp.get_scene.builder(self._lamp, number), number,
+                               "scene_id")
+
+    def iter_flows(self, number=END_OF_LIST):
+        """See Lamp.iter_flows()."""
+        return self._iter_list(Lamp.get_flow.builder(self._lamp, number), number)
+
+    def iter_name_parts(self):
+        """See Lamp.iter_name_parts()."""
+        return self._stream(Lamp.get_name.builder(self._lamp), _is_last_name_part)
+
+    async def read_name(self):
+        """See Lamp.read_name()."""
+        parts = sorted([part async for part in self.iter_name_parts()],
+                       key=lambda part: part.index)
+        return "".join(part.text for part in parts)
+
+    async def apply(self, on=None, rgb=None, temperature=None, brightness=None):
+        """See Lamp.apply()."""
+        return [await getattr(self, name)(*args)
+                for name, args in Lamp.plan(on, rgb, temperature, brightness)]
+
+    async def set_flow(self, flow_id, steps, start=True, store=False):
+        """See Lamp.set_flow()."""
+        return [await getattr(self, name)(*args)
+                for name, args in Lamp.plan_flow(flow_id, steps, start, store)]
+
+
+def _async_cmd(builder):
+    @functools.wraps(builder)
+    async def _wrap(self, *args, **kwargs):
+        return await self._command(builder(self._lamp, *args, **kwargs))
+
+    return _wrap
+
+
+for _name, _method in list(vars(Lamp).items()):
+    if hasattr(_method, "builder"):
+        setattr(AsyncLamp, _name, _async_cmd(_method.builder))
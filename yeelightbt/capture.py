@@ -0,0 +1,187 @@
+"""
+Capturing the frames exchanged with lamps, and replaying them.
+
+    with CaptureWriter("session.cap") as writer:
+        lamp = Lamp(mac, transport=Recorder(BTLEConnection, writer))
+        ...
+
+    stats = replay("session.cap")
+
+A capture is a small header followed by records of a little-endian
+(time, kind, lamp index, handle, length) and the frame itself. The time is
+in seconds since the start of the capture, and the MAC of each lamp is
+stored once in a record of its own.
+"""
+import logging
+import struct
+import threading
+import time
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"YLBTCAP1"
+
+WRITE = 0
+NOTIFICATION = 1
+_MAC = 2
+
+_RECORD = struct.Struct("<dBBHB")
+
+Frame = namedtuple("Frame", "time direction mac handle data")
+
+
+class CaptureWriter:
+    """Appends frames of any number of lamps to a capture file."""
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._macs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _record(self, kind, index, handle, data, now):
+        self._file.write(_RECORD.pack(now, kind, index, handle, len(data)))
+        self._file.write(data)
+
+    def write(self, direction, mac, handle, data):
+        now = time.monotonic() - self._start
+        with self._lock:
+            index = self._macs.get(mac)
+            if index is None:
+                index = self._macs[mac] = len(self._macs)
+                self._record(_MAC, index, 0, mac.encode("ascii"), now)
+            self._record(direction, index, handle, bytes(data), now)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Yields the Frames of a capture."""
+    macs = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            now, kind, index, handle, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if kind == _MAC:
+                macs[index] = data.decode("ascii")
+            else:
+                yield Frame(now, kind, macs[index], handle, data)
+
+
+class Recorder:
+    """Transport factory recording everything written and notified.
+
+    Wraps another transport factory, e.g. BTLEConnection or a Simulator.
+    """
+
+    def __init__(self, transport, writer):
+        self._transport = transport
+        self._writer = writer
+
+    @property
+    def errors(self):
+        return getattr(self._transport, "errors", ())
+
+    def __call__(self, mac):
+        return RecordingConnection(self._transport(mac), self._writer)
+
+
+class RecordingConnection:
+    """Proxy for a transport, recording its frames."""
+
+    def __init__(self, conn, writer):
+        self._conn = conn
+        self._writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def set_callback(self, handle, function):
+        def _record(data):
+            self._writer.write(NOTIFICATION, self._conn.mac, handle, data)
+            return function(data)
+
+        self._conn.set_callback(handle, _record)
+
+    def make_request(self, handle, value, timeout=0, with_response=False):
+        self._writer.write(WRITE, self._conn.mac, handle, value)
+        return self._conn.make_request(handle, value, timeout=timeout,
+                                       with_response=with_response)
+
+
+class ReplayStats:
+    def __init__(self):
+        self.writes = 0
+        self.notifications = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Notifications handled per second."""
+        return self.notifications / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return ("<ReplayStats writes(%s) notifications(%s) errors(%s) "
+                "%.3fs, %.0f/s>" % (self.writes, self.notifications,
+                                    self.errors, self.elapsed, self.rate))
+
+
+def replay(path, speed=None, lamps=None, on_notification=None, **lamp_args):
+    """Feeds the notifications of a capture through Lamp.handle_notification.
+
+    speed 1 replays in recorded time, 2 twice as fast, None as fast as
+    possible. Lamps are created for the captured MACs with lamp_args unless
+    given in lamps, a dictionary keyed by MAC. on_notification is called
+    with the MAC and each parsed response. Returns ReplayStats.
+    """
+    from .lamp import Lamp
+
+    lamps = dict(lamps or {})
+    stats = ReplayStats()
+    start = time.monotonic()
+    for frame in read_capture(path):
+        if speed:
+            delay = frame.time / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if frame.direction == WRITE:
+            stats.writes += 1
+            continue
+
+        lamp = lamps.get(frame.mac)
+        if lamp is None:
+            lamp = lamps[frame.mac] = Lamp(frame.mac, **lamp_args)
+        try:
+            res = lamp.handle_notification(frame.data)
+        except Exception as ex:
+            _LOGGER.warning("Unable to handle %s from %s: %s",
+                            frame.data.hex(), frame.mac, ex)
+            stats.errors += 1
+            continue
+        stats.notifications += 1
+        if on_notification is not None:
+            on_notification(frame.mac, res)
+
+    stats.elapsed = time.monotonic() - start
+    return stats
@@ -1,96 +1,302 @@
 import logging
-from yeelightbt import Lamp
-from bluepy import btle
+import os
 import click
+import shlex
 import sys
 import time
 
+# The library is imported by the commands needing it,
+# keeping --help and scan from loading construct or bluepy needlessly.
+
+from yeelightbt import daemon
+
 # To allow callback debugs, just pass --debug to the tool
 DEBUG = 0
 
-pass_dev = click.make_pass_decorator(Lamp)
+# seconds to wait for the button to be pushed when pairing
+PAIRING_TIMEOUT = 5
+# last status reported to paired_cb
+_pairing_status = None
 
+# seconds, state known to the daemon is used instead of asking the lamp
+DAEMON_STATE_MAX_AGE = 60
 
-@click.pass_context
-def paired_cb(ctx, data):
+HANDLE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "yeelightbt", "handles.json")
+
+# commands not working on the lamps of the invocation
+NOT_IN_BATCH = ("batch", "daemon", "replay", "scan")
+
+# either a Lamp or a LampGroup
+pass_dev = click.pass_obj
+
+
+def _macs(values):
+    return [x.strip() for value in values for x in value.split(",") if x.strip()]
+
+
+def _is_group(dev):
+    from yeelightbt.group import LampGroup
+    return isinstance(dev, LampGroup)
+
+
+def _lamps(dev):
+    if _is_group(dev):
+        return dev.lamps
+    return [dev]
+
+
+def _run(dev, command, *args, **kwargs):
+    """Runs the command on the lamp or on all lamps of the group.
+
+    Returns a dictionary of results keyed by MAC, failures are reported."""
+    if not _is_group(dev):
+        return {dev.mac: getattr(dev, command)(*args, **kwargs)}
+
+    res = dev.run(command, *args, **kwargs)
+    for mac, _, ex, duration in res:
+        if ex is not None:
+            click.echo("%s: %s failed after %.2fs: %s" % (mac, command, duration, ex))
+    return res.results
+
+
+def _echo_entries(dev, iterator, number):
+    """Prints the entries of each lamp as they arrive."""
+    for lamp in _lamps(dev):
+        click.echo("MAC: %s" % lamp.mac)
+        with lamp:
+            for entry in getattr(lamp, iterator)(number):
+                click.echo(entry)
+
+
+# Called from the connection's callback thread, so it only reports the
+# status, the waiting and exiting is done by _wait_for_pairing().
+def paired_cb(data):
+    global _pairing_status
     data = data.payload
+    _pairing_status = data.pairing_status
     if data.pairing_status == "PairRequest":
         click.echo("Waiting for pairing, please push the button/change the brightness")
-        time.sleep(5)
     elif data.pairing_status == "PairSuccess":
         click.echo("We are paired.")
     elif data.pairing_status == "PairFailed":
-        click.echo("Pairing failed, exiting")
-        sys.exit(-1)
+        click.echo("Pairing failed")
     if DEBUG:
         click.echo("Got paired? %s" % data.pairing_status)
 
 
-@click.pass_context
-def notification_cb(ctx, data):
+def _wait_for_pairing():
+    """Gives some time to push the button, exits if the pairing failed."""
+    deadline = time.monotonic() + PAIRING_TIMEOUT
+    while _pairing_status == "PairRequest" and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if _pairing_status == "PairFailed":
+        click.echo("Pairing failed, exiting")
+        sys.exit(-1)
+
+
+def notification_cb(data):
     print("Got notif: %s" % data)
     if DEBUG:
         click.echo("Got notification: %s" % data)
 
 
 @click.group(invoke_without_command=True)
-@click.option('--mac', envvar="YEELIGHTBT_MAC", required=False)
+@click.option('--mac', envvar="YEELIGHTBT_MAC", required=False, multiple=True,
+              help="MAC address, can be given multiple times or comma-separated to control a group of lamps.")
+@click.option('--workers', default=8, help="Maximum number of lamps to talk to concurrently.")
+@click.option('--handle-cache', envvar="YEELIGHTBT_HANDLE_CACHE", default=HANDLE_CACHE,
+              help="File to cache the GATT handles in, pass an empty value to disable.")
+@click.option('--capture', type=click.Path(dir_okay=False), default=None,
+              help="File to record all exchanged frames to, see the replay command.")
+@click.option('--socket', 'socket_path', envvar="YEELIGHTBT_SOCKET", default=daemon.DEFAULT_SOCKET,
+              help="Unix socket of the daemon, commands are sent to it when it is running.")
+@click.option('--no-daemon', is_flag=True, help="Connect directly even if the daemon is running.")
 @click.option('-d', '--debug', default=False, count=True)
 @click.pass_context
-def cli(ctx, mac, debug):
+def cli(ctx, mac, workers, handle_cache, capture, socket_path, no_daemon, debug):
     """ A tool to query Yeelight bedside lamp. """
     if debug:
         logging.basicConfig(level=logging.DEBUG)
         if debug > 1:
+            from bluepy import btle
             btle.Debugging = True
         DEBUG = debug
     else:
         logging.basicConfig(level=logging.INFO)
 
-    # if we are scanning, we do not try to connect.
-    if ctx.invoked_subcommand == "scan":
+    # if we are scanning or replaying, we do not try to connect.
+    if ctx.invoked_subcommand in ("scan", "replay", "daemon"):
         return
 
-    if mac is None:
+    macs = _macs(mac)
+    if not macs:
         logging.error("You have to specify MAC address to use either by setting YEELIGHTBT_MAC environment variable or passing --mac option!")
         sys.exit(1)
 
-    lamp = Lamp(mac, notification_cb, paired_cb,
-                keep_connection=True, wait_after_call=0.2)
-    lamp.connect()
-    lamp.state()
-    ctx.obj = lamp
+    from yeelightbt.group import LampGroup
+
+    if not no_daemon and not capture and daemon.is_running(socket_path):
+        # the daemon already knows the state, unless it was restarted
+        lamps = []
+        for x in macs:
+            client = daemon.Client(socket_path)
+            ctx.call_on_close(client.close)
+            lamps.append(daemon.RemoteLamp(x, client, notification_cb))
+        if len(lamps) == 1:
+            ctx.obj = lamps[0]
+            ctx.obj.state(max_age=DAEMON_STATE_MAX_AGE)
+        else:
+            ctx.obj = LampGroup(lamps, max_workers=workers)
+            ctx.call_on_close(ctx.obj.close)
+            _run(ctx.obj, "state", max_age=DAEMON_STATE_MAX_AGE)
+
+        if ctx.invoked_subcommand is None:
+            ctx.invoke(state)
+        return
+
+    from yeelightbt.handlecache import HandleCache
+    from yeelightbt.lamp import Lamp
+
+    handle_cache = HandleCache(handle_cache or None)
+    transport = None
+    if capture:
+        from yeelightbt.capture import CaptureWriter, Recorder
+        from yeelightbt.connection import BTLEConnection
+        writer = CaptureWriter(capture)
+        ctx.call_on_close(writer.close)
+        transport = Recorder(BTLEConnection, writer)
+    # batches pace themselves with sleep
+    wait_after_call = 0 if ctx.invoked_subcommand == "batch" else 0.2
+    lamps = [Lamp(x, notification_cb, paired_cb,
+                  keep_connection=True, wait_after_call=wait_after_call,
+                  handle_cache=handle_cache, transport=transport) for x in macs]
+    if len(lamps) == 1:
+        lamp = lamps[0]
+        lamp.connect()
+        _wait_for_pairing()
+        lamp.state()
+        ctx.obj = lamp
+    else:
+        # lamps connect on their first use
+        group = LampGroup(lamps, max_workers=workers)
+        ctx.call_on_close(group.close)
+        _run(group, "state")
+        ctx.obj = group
 
     if ctx.invoked_subcommand is None:
         ctx.invoke(state)
 
 @cli.command()
-def scan():
+@click.option('--timeout', default=5, help="Seconds to scan for.")
+@click.option('--expect', multiple=True,
+              help="MAC of a lamp to look for, stops once all have been found.")
+def scan(timeout, expect):
     """ Scans for available devices. """
-    scan = btle.Scanner()
-    sec = 5
-    click.echo("Scanning for %s seconds" % sec)
+    from bluepy import btle
+    from yeelightbt import scanner
+    click.echo("Scanning for %s seconds" % timeout)
+    found = set()
     try:
-        devs = scan.scan(sec)
+        for adv in scanner.scan(timeout, expect=expect):
+            found.add(adv.mac)
+            click.echo("%s %s (%s), rssi=%d" % (adv.model, adv.mac, adv.name, adv.rssi))
     except btle.BTLEException as ex:
         logging.error("Unable to scan for devices, did you set-up permissions for bluepy-helper correctly? ex: %s" % ex)
         return
 
-    click.echo("Devices found:")
-    for dev in devs:
-        localname = dev.getValueText(9)
-        if not localname: continue
-        if localname.startswith("XMCTD_"):
-            click.echo("Bedlight lamp v1  %s (%s), rssi=%d" % (dev.addr, localname, dev.rssi))
-        elif localname.startswith("yeelight_ms"):
-            click.echo("Candela %s (%s), rssi=%d" % (dev.addr, localname, dev.rssi))
+    missing = set(mac.lower() for mac in expect) - found
+    if missing:
+        click.echo("Not found: %s" % ", ".join(sorted(missing)))
+
+@cli.command("daemon")
+@click.pass_context
+def run_daemon(ctx):
+    """Keeps the lamps connected and serves the other commands."""
+    from yeelightbt.handlecache import HandleCache
+    from yeelightbt.lamp import Lamp
+
+    params = ctx.parent.params
+    handle_cache = HandleCache(params["handle_cache"] or None)
+    server = daemon.Daemon(params["socket_path"], lambda mac: Lamp(
+        mac, keep_connection=True, handle_cache=handle_cache))
+    server.warm_up(_macs(params["mac"]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option('--speed', type=float, default=None,
+              help="Replay speed relative to the recording, as fast as possible by default.")
+@click.option('-v', '--verbose', is_flag=True, help="Print every notification.")
+def replay(path, speed, verbose):
+    """Feeds the notifications of a capture through the parser."""
+    def _echo(mac, res):
+        click.echo("%s: %s" % (mac, res))
+
+    from yeelightbt.capture import replay as replay_capture
+    stats = replay_capture(path, speed=speed,
+                            on_notification=_echo if verbose else None)
+    click.echo(stats)
+
+@cli.command()
+@click.argument("script", type=click.File("r"), default="-")
+@click.option('--keep-going', is_flag=True, help="Continue after a failing line.")
+@click.pass_context
+def batch(ctx, script, keep_going):
+    """Runs the commands of a file or stdin over the same connection.
+
+    One command per line as given on the command line, e.g. `color 255 0 0 50`.
+    `sleep SECONDS` pauses, empty lines and lines starting with # are skipped.
+    """
+    ctx.meta["batch"] = True
+    failed = 0
+    start = time.monotonic()
+    for number, line in enumerate(script, 1):
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as ex:
+            args = None
+            error = ex
+        if args == []:
+            continue
+
+        line_start = time.monotonic()
+        try:
+            if args is None:
+                raise click.UsageError(str(error))
+            if args[0] == "sleep":
+                time.sleep(float(args[1]))
+            else:
+                command = cli.get_command(ctx, args[0])
+                if command is None or args[0] in NOT_IN_BATCH:
+                    raise click.UsageError("Unknown command %s" % args[0])
+                with command.make_context(args[0], args[1:], parent=ctx) as sub_ctx:
+                    command.invoke(sub_ctx)
+        except Exception as ex:
+            failed += 1
+            click.echo("line %s: %s failed: %s" % (number, line.strip(), ex), err=True)
+            if not keep_going:
+                break
+        else:
+            click.echo("[%8.1f ms] %s" % (1000 * (time.monotonic() - line_start), line.strip()),
+                       err=True)
+
+    click.echo("Done in %.3fs" % (time.monotonic() - start), err=True)
+    if failed:
+        ctx.exit(1)
 
 @cli.command()
 @pass_dev
 def device_info(dev):
     """Returns hw & sw version."""
-    vers = dev.get_version_info()
-    serial = dev.get_serial_number()
+    vers = _run(dev, "get_version_info")
+    serial = _run(dev, "get_serial_number")
+    for mac in vers:
+        click.echo("MAC: %s" % mac)
+        click.echo("Version: %s" % vers[mac])
+        click.echo("Serial: %s" % serial.get(mac))
 
 @cli.command(name="time")
 @click.argument("new_time", default=None, required=False)
@@ -102,20 +308,21 @@ def time_(dev, new_time):
         dev.set_time(new_time)
     else:
         click.echo("Requesting time.")
-        dev.get_time()
+        for mac, res in _run(dev, "get_time").items():
+            click.echo("%s: %s" % (mac, res))
 
 @cli.command()
 @pass_dev
 def on(dev):
     """ Turns the lamp on. """
-    dev.turn_on()
+    _run(dev, "turn_on")
 
 
 @cli.command()
 @pass_dev
 def off(dev):
     """ Turns the lamp off. """
-    dev.turn_off()
+    _run(dev, "turn_off")
 
 @cli.command()
 @pass_dev
@@ -130,9 +337,10 @@ def brightness(dev, brightness):
     """ Gets or sets the brightness. """
     if brightness:
         click.echo("Setting brightness to %s" % brightness)
-        dev.set_brightness(brightness)
+        _run(dev, "set_brightness", brightness)
     else:
-        click.echo("Brightness: %s" % dev.brightness)
+        for lamp in _lamps(dev):
+            click.echo("Brightness: %s" % lamp.brightness)
 
 
 @cli.command()
@@ -145,14 +353,17 @@ def color(dev, red, green, blue, brightness):
     """ Gets or sets the color. """
     if red or green or blue:
         click.echo("Setting color: %s %s %s (brightness: %s)" % (red, green, blue, brightness))
-        dev.set_color(red, green, blue, brightness)
+        _run(dev, "set_color", red, green, blue, brightness)
     else:
-        click.echo("Color: %s" % (dev.color,))
+        for lamp in _lamps(dev):
+            click.echo("Color: %s" % (lamp.color,))
 
 @cli.command()
 @pass_dev
 def name(dev):
-    dev.get_name()
+    """Gets the name."""
+    for mac, res in _run(dev, "read_name").items():
+        click.echo("%s: %s" % (mac, res))
 
 @cli.command()
 @click.argument("number", type=int, default=255, required=False)
@@ -160,16 +371,16 @@ def name(dev):
 @pass_dev
 def scene(dev, number, name):
     if name:
-        dev.set_scene(number, name)
+        _run(dev, "set_scene", number, name)
     else:
-        dev.get_scene(number)
+        _echo_entries(dev, "iter_scenes", number)
 
 @cli.command()
 @click.argument("number", type=int, default=255, required=False)
 @pass_dev
 def alarm(dev, number):
     """Gets alarms."""
-    dev.get_alarm(number)
+    _echo_entries(dev, "iter_alarms", number)
 
 @cli.command()
 @pass_dev
@@ -177,29 +388,97 @@ def night_mode(dev):
     """Gets or sets night mode settings."""
     dev.get_nightmode()
 
-@cli.command()
+def _flow_step(value):
+    """Parses SECONDS:RED,GREEN,BLUE[@BRIGHTNESS] or SECONDS:KELVINk[@BRIGHTNESS]."""
+    from yeelightbt.lamp import FlowStep
+    try:
+        duration, target = value.split(":", 1)
+        target, _, brightness = target.partition("@")
+        step = {"duration": int(duration)}
+        if brightness:
+            step["brightness"] = int(brightness)
+        if target.lower().endswith("k"):
+            step["temperature"] = int(target[:-1])
+        else:
+            step["rgb"] = tuple(int(x) for x in target.split(","))
+            if len(step["rgb"]) != 3:
+                raise ValueError("three color values needed")
+    except ValueError as ex:
+        raise click.BadParameter("%s is not a valid step: %s" % (value, ex))
+    return FlowStep(**step)
+
+class _FlowGroup(click.Group):
+    """Keeps `flow NUMBER` working as the short form of `flow get NUMBER`."""
+
+    def parse_args(self, ctx, args):
+        if args and args[0].isdigit():
+            args = ["get"] + list(args)
+        return super().parse_args(ctx, args)
+
+@cli.group(cls=_FlowGroup, invoke_without_command=True)
+@click.pass_context
+def flow(ctx):
+    """Gets, sets, starts and stops flows."""
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(flow_get)
+
+@flow.command("get")
 @click.argument("number", type=int, default=255, required=False)
 @pass_dev
-def flow(dev, number):
-    dev.get_flow(number)
+def flow_get(dev, number):
+    """Gets flows."""
+    _echo_entries(dev, "iter_flows", number)
+
+@flow.command("set")
+@click.argument("flow_id", type=int)
+@click.argument("steps", nargs=-1, required=True)
+@click.option("--store", is_flag=True, help="Keep the flow on the lamp.")
+@click.option("--no-start", is_flag=True, help="Only upload the flow.")
+@pass_dev
+def flow_set(dev, flow_id, steps, store, no_start):
+    """Uploads a flow the lamp runs on its own.
+
+    Each step is SECONDS:RED,GREEN,BLUE or SECONDS:KELVINk,
+    optionally followed by @BRIGHTNESS, e.g. `2:255,0,0@80 5:2700k@20`.
+    """
+    steps = [_flow_step(step) for step in steps]
+    click.echo("Setting flow %s with %s steps" % (flow_id, len(steps)))
+    _run(dev, "set_flow", flow_id, steps, start=not no_start, store=store)
+
+@flow.command("start")
+@click.argument("flow_id", type=int)
+@pass_dev
+def flow_start(dev, flow_id):
+    """Starts a flow."""
+    _run(dev, "start_flow", flow_id)
+
+@flow.command("stop")
+@click.argument("flow_id", type=int)
+@pass_dev
+def flow_stop(dev, flow_id):
+    """Stops a flow."""
+    _run(dev, "stop_flow", flow_id)
 
 @cli.command()
 @click.argument("time", type=int, default=0, required=False)
 @pass_dev
-def sleep(dev: Lamp, time):
+def sleep(dev, time):
     dev.get_sleep()
 
 @cli.command()
 @pass_dev
 def state(dev):
     """ Requests the state from the device. """
-    click.echo(click.style("MAC: %s" % dev.mac, bold=dev.is_on))
-    click.echo("  Mode: %s" % dev.mode)
-    click.echo("  Color: %s" % (dev.color,))
-    click.echo("  Temperature: %s" % dev.temperature)
-    click.echo("  Brightness: %s" % dev.brightness)
+    for lamp in _lamps(dev):
+        click.echo(click.style("MAC: %s" % lamp.mac, bold=lamp.is_on))
+        click.echo("  Mode: %s" % lamp.mode)
+        click.echo("  Color: %s" % (lamp.color,))
+        click.echo("  Temperature: %s" % lamp.temperature)
+        click.echo("  Brightness: %s" % lamp.brightness)
 
-    dev._conn.wait(60)
+    if (not _is_group(dev) and not isinstance(dev, daemon.RemoteLamp)
+            and not click.get_current_context().meta.get("batch")):
+        dev._conn.wait(60)
 
 
 @cli.command()
@@ -210,9 +489,10 @@ def temperature(dev, temperature, brightness):
     """ Gets and sets the color temperature 1700-6500K """
     if temperature:
         click.echo("Setting the temperature to %s (brightness: %s)" % (temperature, brightness))
-        dev.set_temperature(temperature, brightness)
+        _run(dev, "set_temperature", temperature, brightness)
     else:
-        click.echo("Temperature: %s" % dev.temperature)
+        for lamp in _lamps(dev):
+            click.echo("Temperature: %s" % lamp.temperature)
 
 
 if __name__ == "__main__":
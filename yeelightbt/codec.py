@@ -0,0 +1,357 @@
+""" Fast encoding and decoding of the request and response frames.
+
+The construct definitions in structures.py are the reference for the
+protocol, but interpreting them costs a lot for every 18-byte frame.
+FastCodec implements the same frames with precompiled struct formats and
+enum tables taken from structures.py, and falls back to construct for
+anything it does not know about, so errors and corner cases behave
+exactly like Request.build() and Response.parse().
+"""
+import datetime
+import logging
+import struct
+import threading
+
+from construct import Container, EnumInteger
+
+from .structures import (
+    Request, Response, RequestType, ResponseType, StateResult, Alarm,
+    NightMode, SleepTimerResult, Version, ColorFlow, SimpleFlow,
+    PairingStatus, WeekDayEnum)
+
+_LOGGER = logging.getLogger(__name__)
+
+FRAME_SIZE = 18
+HEADER = 0x43
+
+PAIR_DEVID = (0x1234).to_bytes(16, "big")
+
+
+def _table(structure, name):
+    """Returns the decoding table of a named enum or mapping field."""
+    return getattr(structure, name).subcon.decmapping
+
+
+def _enum(table, value):
+    try:
+        return table[value]
+    except KeyError:
+        return EnumInteger(value)
+
+
+def _bcd(value):
+    """Same as structures.RawAsInt, 0x12 is decoded as 12."""
+    return int('{:02x}'.format(value))
+
+
+def _pascal(data, offset):
+    length = data[offset]
+    end = offset + 1 + length
+    if end > FRAME_SIZE:
+        raise ValueError("string does not fit into the frame")
+    return data[offset + 1:end].decode("ascii")
+
+
+class FrameTemplate:
+    """Preallocated request frame, where only the payload gets rewritten.
+
+    fill() returns a copy of the frame, as a command filled in by another
+    thread may be written after this one; the filling itself is locked.
+    """
+    def __init__(self, type_, fmt):
+        self._struct = struct.Struct(fmt)
+        self._lock = threading.Lock()
+        self.frame = bytearray(FRAME_SIZE)
+        self.frame[0] = HEADER
+        self.frame[1] = RequestType.encmapping[type_]
+
+    def fill(self, *values):
+        with self._lock:
+            self._struct.pack_into(self.frame, 2, *values)
+            return bytes(self.frame)
+
+
+class ConstructCodec:
+    """Codec interpreting the construct definitions in structures.py."""
+    name = "construct"
+
+    # shared by all instances, the frames never change
+    _constant_frames = {}
+
+    def build_request(self, query):
+        return Request.build(query)
+
+    def constant_request(self, type_):
+        """Returns the frame for a request without payload."""
+        frame = self._constant_frames.get(type_)
+        if frame is None:
+            frame = self._constant_frames[type_] = Request.build({"type": type_})
+        return frame
+
+    def parse_response(self, data):
+        return Response.parse(data)
+
+
+class FastCodec(ConstructCodec):
+    """Hand-specialized codec, equivalent to ConstructCodec.
+
+    Frames and payloads which are not known to this codec, or which would
+    cause an error, are handed over to construct.
+    """
+    name = "fast"
+
+    _ONOFF = struct.Struct(">BBB15x")
+    _COLOR = struct.Struct(">BBBBBBB11x")
+    _BRIGHTNESS = struct.Struct(">BBB15x")
+    _TEMPERATURE = struct.Struct(">BBHB13x")
+    _PAIR = struct.Struct(">BB16s")
+    _ID = struct.Struct(">BBB15x")
+    _FLOW = struct.Struct(">BBBBBBBBBBBHBH2x")
+    _SIMPLEFLOW_REQUEST = struct.Struct(">BBBBBB12B")
+
+    _STATE = struct.Struct(">BBBBBBBHB")
+    _ALARM = struct.Struct(">BBBBBBHBBB")
+    _NIGHTMODE = struct.Struct(">BBBBBB")
+    _SLEEP = struct.Struct(">BBBH")
+    _VERSION = struct.Struct(">BHHHH")
+    _TIME = struct.Struct(">BBBBBBB")
+    _SIMPLEFLOW = struct.Struct(">BBBB12B")
+
+    def __init__(self):
+        self._request_types = dict(RequestType.encmapping)
+        self._response_types = dict(ResponseType.decmapping)
+
+        self._onoff = {True: 0x01, False: 0x02}
+        self._states = _table(StateResult, "state")
+        self._modes = _table(StateResult, "mode")
+        self._alarm_modes = _table(Alarm, "mode")
+        self._alarm_actions = _table(Alarm, "action")
+        self._alarm_sync = _table(Alarm, "sync_phone")
+        self._alarm_enabled = _table(Alarm, "enabled")
+        self._weekdays = WeekDayEnum.flags
+        self._nightmode_states = _table(NightMode, "state")
+        self._sleep_enabled = _table(SleepTimerResult, "enabled")
+        self._sleep_states = _table(SleepTimerResult, "state")
+        self._versions = _table(Version, "currentrunning")
+        self._flow_types = _table(SimpleFlow, "type")
+        self._flow_type_values = SimpleFlow.type.subcon.encmapping
+        self._flow_commands = ColorFlow.cmd.subcon.encmapping
+        self._flow_modes = ColorFlow.rgb_mode.subcon.subcon.encmapping
+        self._pairing_states = _table(PairingStatus, "pairing_status")
+
+        self._builders = {
+            "SetOnOff": self._build_onoff,
+            "SetColor": self._build_color,
+            "SetBrightness": self._build_brightness,
+            "SetTemperature": self._build_temperature,
+            "Pair": self._build_pair,
+            "GetAlarm": self._build_id,
+            "GetScene": self._build_id,
+            "GetSimpleFlow": self._build_id,
+            "SetScene": self._build_scene,
+            "SetFlow": self._build_flow,
+            "SetSimpleFlow": self._build_simpleflow,
+        }
+        # requests without a payload are always the same
+        self._constants = {}
+        for name, value in self._request_types.items():
+            if name not in self._builders:
+                self._constants[name] = bytes((HEADER, value)) + bytes(FRAME_SIZE - 2)
+
+        self._parsers = {
+            "StateResult": self._parse_state,
+            "AlarmResult": self._parse_alarm,
+            "WakeUpResult": self._parse_alarm,
+            "SceneResult": self._parse_scene,
+            "NightModeResult": self._parse_nightmode,
+            "SleepTimerResult": self._parse_sleep,
+            "VersionResult": self._parse_version,
+            "SerialNumberResult": self._parse_serial,
+            "TimeResult": self._parse_time,
+            "SimpleFlowResult": self._parse_simpleflow,
+            "PairingResult": self._parse_pairing,
+            "GetNameResult": self._parse_name,
+        }
+
+    def build_request(self, query):
+        try:
+            type_ = query["type"]
+            if type_ in self._constants:
+                return self._constants[type_]
+            return self._builders[type_](self._request_types[type_],
+                                         query.get("payload"))
+        except Exception:
+            # let construct either handle it or raise the proper error
+            return Request.build(query)
+
+    def constant_request(self, type_):
+        frame = self._constants.get(type_)
+        if frame is None:
+            frame = super().constant_request(type_)
+        return frame
+
+    def parse_response(self, data):
+        try:
+            if len(data) < FRAME_SIZE or data[0] != HEADER:
+                raise ValueError("not a valid frame")
+            type_ = self._response_types[data[1]]
+            parser = self._parsers.get(type_)
+            payload = parser(data) if parser else None
+            return Container(type=type_, payload=payload)
+        except Exception:
+            return Response.parse(data)
+
+    def _build_onoff(self, type_, payload):
+        return self._ONOFF.pack(HEADER, type_, self._onoff[payload["state"]])
+
+    def _build_color(self, type_, payload):
+        return self._COLOR.pack(HEADER, type_,
+                                payload.get("red") or 0,
+                                payload.get("green") or 0,
+                                payload.get("blue") or 0,
+                                payload.get("white") or 0,
+                                payload.get("brightness") or 0)
+
+    def _build_brightness(self, type_, payload):
+        return self._BRIGHTNESS.pack(HEADER, type_, payload["brightness"])
+
+    def _build_temperature(self, type_, payload):
+        brightness = payload.get("brightness")
+        if brightness is None:
+            brightness = 255
+        return self._TEMPERATURE.pack(HEADER, type_,
+                                      payload["temperature"], brightness)
+
+    def _build_pair(self, type_, payload):
+        devid = payload.get("devid") if payload is not None else None
+        if devid is None:
+            devid = PAIR_DEVID
+        elif isinstance(devid, int):
+            devid = devid.to_bytes(16, "big")
+        elif not isinstance(devid, bytes) or len(devid) != 16:
+            raise ValueError("invalid devid")
+        return self._PAIR.pack(HEADER, type_, devid)
+
+    def _build_id(self, type_, payload):
+        return self._ID.pack(HEADER, type_, payload["id"])
+
+    def _build_scene(self, type_, payload):
+        text = payload["text"].encode("ascii")
+        idx = payload.get("idx")
+        frame = bytes((HEADER, type_, payload["scene_id"],
+                       0 if idx is None else idx, len(text))) + text
+        if len(frame) > FRAME_SIZE:
+            raise ValueError("scene name does not fit into the frame")
+        return frame + bytes(FRAME_SIZE - len(frame))
+
+    def _build_flow(self, type_, payload):
+        def _get(name):
+            return payload.get(name) or 0
+
+        mode = payload.get("rgb_mode") or 0
+        if isinstance(mode, str):
+            mode = self._flow_modes[mode]
+        return self._FLOW.pack(HEADER, type_, payload["id"], _get("pkt_num"),
+                               self._flow_commands[payload["cmd"]], mode,
+                               _get("red"), _get("green"), _get("blue"),
+                               _get("white"), _get("brightness"),
+                               _get("temperature"), _get("brightness"),
+                               _get("time"))
+
+    def _build_simpleflow(self, type_, payload):
+        colors = []
+        for name in ("first", "second", "third", "fourth"):
+            color = payload.get(name) or {}
+            colors += [color.get("red") or 0, color.get("green") or 0,
+                       color.get("blue") or 0]
+        return self._SIMPLEFLOW_REQUEST.pack(
+            HEADER, type_, payload["id"], self._flow_type_values[payload["type"]],
+            payload["time"], payload.get("control") or 0, *colors)
+
+    def _parse_state(self, data):
+        (state, mode, red, green, blue,
+         white, brightness, temperature, fraction) = self._STATE.unpack_from(data, 2)
+        return Container(state=self._states[state],
+                         mode=_enum(self._modes, mode),
+                         red=red, green=green, blue=blue, white=white,
+                         brightness=brightness, temperature=temperature,
+                         temp_fraction=fraction)
+
+    def _parse_alarm(self, data):
+        (id_, hour, minute, second, mode, days, gradual_change,
+         action, sync_phone, enabled) = self._ALARM.unpack_from(data, 2)
+        mode = _enum(self._alarm_modes, mode)
+        if mode == "Single":
+            days = _bcd(days)
+        elif mode == "RepeatOnDays":
+            flags = Container()
+            flags._flagsenum = True
+            for name, value in self._weekdays.items():
+                flags[name] = days & value == value
+            days = flags
+
+        return Container(id=id_,
+                         time=datetime.time(hour=_bcd(hour),
+                                            minute=_bcd(minute),
+                                            second=_bcd(second)),
+                         mode=mode, days=days,
+                         gradual_change=gradual_change,
+                         action=_enum(self._alarm_actions, action),
+                         sync_phone=_enum(self._alarm_sync, sync_phone),
+                         enabled=_enum(self._alarm_enabled, enabled))
+
+    def _parse_scene(self, data):
+        return Container(scene_id=data[2], idx=data[3], text=_pascal(data, 4))
+
+    def _parse_nightmode(self, data):
+        (state, brightness, start_hour, start_minute,
+         end_hour, end_minute) = self._NIGHTMODE.unpack_from(data, 2)
+        start = datetime.time(hour=_bcd(start_hour), minute=_bcd(start_minute))
+        end = datetime.time(hour=_bcd(end_hour), minute=_bcd(end_minute))
+        return Container(state=_enum(self._nightmode_states, state),
+                         brightness=brightness,
+                         start=Container(time=start),
+                         end=Container(time=end))
+
+    def _parse_sleep(self, data):
+        enabled, minutes, state, left_time = self._SLEEP.unpack_from(data, 2)
+        return Container(enabled=_enum(self._sleep_enabled, enabled),
+                         minutes=minutes,
+                         state=_enum(self._sleep_states, state),
+                         left_time=left_time)
+
+    def _parse_version(self, data):
+        current, hw, app1, app2, beacon = self._VERSION.unpack_from(data, 2)
+        return Container(currentrunning=_enum(self._versions, current),
+                         hw_version=hw, sw_version_app1=app1,
+                         sw_version_app2=app2, beacon_version=beacon)
+
+    def _parse_serial(self, data):
+        return Container(serialno=int.from_bytes(data[2:14], "big"))
+
+    def _parse_time(self, data):
+        (second, minute, hour, day,
+         dow, month, year) = self._TIME.unpack_from(data, 2)
+        _bcd(dow)  # not used, but needs to be valid
+        return Container(time=datetime.datetime(
+            year=_bcd(year) + 2000, month=_bcd(month), day=_bcd(day),
+            hour=_bcd(hour), minute=_bcd(minute), second=_bcd(second)))
+
+    def _parse_simpleflow(self, data):
+        values = self._SIMPLEFLOW.unpack_from(data, 2)
+        id_, type_, time, control = values[:4]
+        colors = [Container(red=values[i], green=values[i + 1], blue=values[i + 2])
+                  for i in range(4, 16, 3)]
+        return Container(id=id_, type=_enum(self._flow_types, type_),
+                         time=time, control=control,
+                         first=colors[0], second=colors[1],
+                         third=colors[2], fourth=colors[3])
+
+    def _parse_pairing(self, data):
+        return Container(pairing_status=_enum(self._pairing_states, data[2]))
+
+    def _parse_name(self, data):
+        return Container(id=data[2], index=data[3], text=_pascal(data, 4))
+
+
+DEFAULT_CODEC = FastCodec()
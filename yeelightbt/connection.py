@@ -27,82 +27,314 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 
 """
+import collections
+import contextlib
 import logging
 import codecs
+import os
+import select
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from bluepy import btle
 
+from .transport import Transport
+
 DEFAULT_TIMEOUT = 3
 
+# bluepy only polls its helper with a timeout, with 0 it blocks until the
+# next line. The pump reads once the helper's output is readable already,
+# poll() waits this long once to find that nothing is pending.
+READ_TIMEOUT = 0.001
+
+# threads calling the callbacks, those of a connection are called in order
+CALLBACK_THREADS = 4
+
 _LOGGER = logging.getLogger(__name__)
 
-class BTLEConnection(btle.DefaultDelegate):
+
+class NotificationPump:
+    """Reads the notifications of all registered connections in one thread.
+
+    The thread blocks on the stdout of the bluepy-helpers without holding
+    any lock, so idle connections cost nothing, and only takes the I/O lock
+    of a connection to read what is already there. While a write holds that
+    lock, the write reads the notifications itself and hands the connection
+    back when done. Callbacks are called from a few other threads, so that
+    they cannot hold up the reading, nor a slow one the other connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}  # helper's fd -> connection
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._callbacks = ThreadPoolExecutor(CALLBACK_THREADS,
+                                             thread_name_prefix="yeelightbt-callbacks")
+        self._pending = {}  # connection -> notifications to call back
+        self._thread = None
+
+    def register(self, conn, fd):
+        with self._lock:
+            self._connections[fd] = conn
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name="yeelightbt-notifications")
+                self._thread.start()
+        self.wakeup()
+
+    def unregister(self, conn):
+        with self._lock:
+            for fd, registered in list(self._connections.items()):
+                if registered is conn:
+                    del self._connections[fd]
+        self.wakeup()
+
+    def wakeup(self):
+        os.write(self._wakeup_write, b"\0")
+
+    def dispatch(self, conn, handle, data):
+        with self._lock:
+            pending = self._pending.get(conn)
+            if pending is not None:
+                # called back by the running _call_back()
+                pending.append((handle, data))
+                return
+            self._pending[conn] = collections.deque([(handle, data)])
+        self._callbacks.submit(self._call_back, conn)
+
+    def _call_back(self, conn):
+        pending = self._pending[conn]
+        while True:
+            with self._lock:
+                if not pending:
+                    del self._pending[conn]
+                    return
+                handle, data = pending.popleft()
+            conn._call_back(handle, data)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                connections = {fd: conn for fd, conn in self._connections.items()
+                               if not conn._parked}
+            # a helper gone meanwhile may have left its fd to somebody else
+            for fd, conn in list(connections.items()):
+                if conn._helper_fd() != fd:
+                    del connections[fd]
+                    self._drop(conn, "the helper has stopped")
+            try:
+                readable, _, _ = select.select(
+                    [self._wakeup_read] + list(connections), [], [])
+            except (OSError, ValueError):
+                # a connection was closed meanwhile
+                continue
+
+            for fd in readable:
+                if fd == self._wakeup_read:
+                    os.read(fd, 512)
+                    continue
+                conn = connections[fd]
+                try:
+                    conn._read()
+                except Exception as ex:
+                    # the waiting threads read, and fail, on their own again
+                    self._drop(conn, ex)
+
+    def _drop(self, conn, reason):
+        if not conn._pumped:
+            # disconnected meanwhile
+            self.unregister(conn)
+            return
+        _LOGGER.warning("Stopped reading notifications from %s: %s",
+                        conn.mac, reason)
+        self.unregister(conn)
+        conn._stop_pumping()
+
+
+_PUMP = None
+
+
+def get_pump():
+    """Returns the notification pump shared by all connections."""
+    global _PUMP
+    if _PUMP is None:
+        _PUMP = NotificationPump()
+    return _PUMP
+
+
+class BTLEConnection(btle.DefaultDelegate, Transport):
     """Representation of a BTLE Connection."""
 
-    def __init__(self, mac):
-        """Initialize the connection."""
+    errors = (btle.BTLEException, BrokenPipeError)
+    handle_errors = (btle.BTLEGattError,)
+
+    def __init__(self, mac, pump=True):
+        """Initialize the connection.
+
+        With pump, notifications are read by the shared NotificationPump
+        instead of the threads waiting for them."""
         btle.DefaultDelegate.__init__(self)
+        Transport.__init__(self, mac)
 
         self._conn = btle.Peripheral()
         self._conn.withDelegate(self)
-        self._mac = mac
-        self._callbacks = {}
+        self._io_lock = threading.RLock()
+        self._notified = threading.Condition()
+        self._pump = get_pump() if pump else None
+        self._pumped = False
+        # set by the pump when it found the I/O lock taken
+        self._parked = False
+
+    @property
+    def pushes_notifications(self):
+        return self._pumped
+
+    @contextlib.contextmanager
+    def _io(self):
+        """Holds the I/O lock, handing the connection back to the pump."""
+        with self._io_lock:
+            yield
+        if self._parked:
+            self._parked = False
+            self._pump.wakeup()
+
+    def _helper_stdout(self):
+        # bluepy-helper reports everything through its stdout
+        helper = getattr(self._conn, "_helper", None)
+        if helper is None or helper.stdout is None or helper.stdout.closed:
+            return None
+        return helper.stdout
+
+    def _helper_fd(self):
+        stdout = self._helper_stdout()
+        return stdout.fileno() if stdout is not None else None
 
     def connect(self):
         _LOGGER.debug("Trying to connect to %s", self._mac)
-        try:
-            self._conn.connect(self._mac)
-        except btle.BTLEException as ex:
-            _LOGGER.warning("Unable to connect to the device %s, retrying: %s", self._mac, ex)
+        with self._io():
             try:
                 self._conn.connect(self._mac)
-            except Exception as ex2:
-                _LOGGER.error("Second connection try to %s failed: %s", self._mac, ex2)
+            except btle.BTLEException as ex:
+                _LOGGER.warning("Unable to connect to the device %s: %s", self._mac, ex)
                 raise
 
+            stdout = self._helper_stdout()
+            if stdout is not None:
+                # read in chunks, the lines following the one bluepy asked
+                # for would be buffered where polling does not see them
+                stdout._CHUNK_SIZE = 1
+            if self._pump is not None and stdout is not None:
+                self._pumped = True
+                self._pump.register(self, stdout.fileno())
+
         _LOGGER.debug("Connected to %s", self._mac)
 
     def disconnect(self):
-        if self._conn:
-            self._conn.disconnect()
-            self._conn = None
+        if self._pumped:
+            self._pump.unregister(self)
+            self._stop_pumping()
+        with self._io():
+            if self._conn:
+                self._conn.disconnect()
+                self._conn = None
+
+    def _stop_pumping(self):
+        self._pumped = False
+        with self._notified:
+            self._notified.notify_all()
+
+    def _read(self):
+        """Called by the pump when the helper has something to say."""
+        if not self._io_lock.acquire(blocking=False):
+            self._parked = True
+            # the writer may have released it before seeing _parked
+            if not self._io_lock.acquire(blocking=False):
+                return
+            self._parked = False
+        try:
+            if self._pumped and self._conn is not None:
+                self._conn.waitForNotifications(READ_TIMEOUT)
+        finally:
+            self._io_lock.release()
+
+    def _call_back(self, handle, data):
+        callback = self._callbacks.get(handle)
+        if callback is not None:
+            try:
+                callback(data)
+            except Exception as ex:
+                _LOGGER.warning("Unable to handle notification %s from %s: %s",
+                                codecs.encode(data, 'hex'), self._mac, ex)
+        with self._notified:
+            self._notified.notify_all()
 
     def wait(self, sec):
+        if self._pumped:
+            time.sleep(sec)
+            return
+
         end = time.time() + sec
-        while time.time() < end:
-            self._conn.waitForNotifications(timeout=0.1)
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            with self._io():
+                self._conn.waitForNotifications(timeout=remaining)
+
+    def wait_for(self, condition, timeout):
+        """Waits for notifications until condition becomes true.
+
+        Returns False if that did not happen in timeout seconds."""
+        end = time.time() + timeout
+        if self._pumped:
+            with self._notified:
+                self._notified.wait_for(
+                    lambda: bool(condition) or not self._pumped, timeout)
+            if condition or self._pumped:
+                return bool(condition)
+
+        while not condition:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            with self._io():
+                self._conn.waitForNotifications(timeout=remaining)
+
+        return True
+
+    def poll(self):
+        with self._io():
+            if self._conn is None:
+                return
+            while self._conn.waitForNotifications(timeout=READ_TIMEOUT):
+                pass
 
     def get_services(self):
-        return self._conn.getServices()
+        with self._io():
+            return self._conn.getServices()
 
     def get_characteristics(self, uuid=None):
-        if uuid:
-            _LOGGER.info("Requesting characteristics for uuid %s", uuid)
-            return self._conn.getCharacteristics(uuid=uuid)
-        return self._conn.getCharacteristics()
+        with self._io():
+            if uuid:
+                _LOGGER.info("Requesting characteristics for uuid %s", uuid)
+                return self._conn.getCharacteristics(uuid=uuid)
+            return self._conn.getCharacteristics()
 
     def handleNotification(self, handle, data):
         """Handle Callback from a Bluetooth (GATT) request."""
         _LOGGER.debug("Got notification from %s: %s", handle, codecs.encode(data, 'hex'))
-        if handle in self._callbacks:
-            self._callbacks[handle](data)
-
-    @property
-    def mac(self):
-        """Return the MAC address of the connected device."""
-        return self._mac
-
-    def set_callback(self, handle, function):
-        """Set the callback for a Notification handle. It will be called with the parameter data, which is binary."""
-        self._callbacks[handle] = function
+        if self._pumped:
+            self._pump.dispatch(self, handle, data)
+            return
+        self._call_back(handle, data)
 
     def make_request(self, handle, value, timeout=0, with_response=False):
         """Write a GATT Command without callback - not utf-8."""
         _LOGGER.debug("Writing %s to %s with with_response=%s", codecs.encode(value, 'hex'), handle, with_response)
-        res = self._conn.writeCharacteristic(handle, value, withResponse=with_response)
+        with self._io():
+            res = self._conn.writeCharacteristic(handle, value, withResponse=with_response)
         if timeout:
             self.wait(timeout)
 
         return res
-
@@ -0,0 +1,356 @@
+"""
+Daemon keeping lamps connected, serving commands over a Unix socket.
+
+    $ yeelightbt --mac f8:24:41:xx:xx:xx daemon &
+    $ yeelightbt --mac f8:24:41:xx:xx:xx off   # served by the daemon
+
+The protocol is one JSON object per line in both directions. A request
+names the lamp, the Lamp method and its arguments:
+
+    {"mac": "f8:24:41:xx:xx:xx", "command": "set_brightness", "args": [50]}
+
+and is answered with the result and the lamp's last known state:
+
+    {"ok": true, "result": null, "lamp": {"is_on": true, ...}}
+    {"ok": false, "error": "..."}
+
+The command "watch" instead answers with the state of the lamp whenever
+the lamp reports it, until the client closes the connection.
+
+Lamps stay connected between the requests, so a command costs a single
+round trip to the lamp instead of connecting, discovering and pairing.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or
+    os.path.join(os.path.expanduser("~"), ".cache", "yeelightbt"),
+    "yeelightbt.sock")
+
+# allowed besides the Lamp commands
+EXTRA_COMMANDS = {"apply", "set_flow", "read_name", "iter_alarms",
+                  "iter_scenes", "iter_flows", "iter_name_parts"}
+
+# streams the state of a lamp, see Daemon.watch()
+WATCH = "watch"
+
+# how often watching reads notifications of transports not pushing them
+WATCH_POLL_INTERVAL = 1
+
+
+class DaemonError(Exception):
+    """Raised by the client when the daemon reports an error."""
+
+
+def _commands():
+    from .lamp import Lamp
+    return {name for name, method in vars(Lamp).items()
+            if hasattr(method, "builder")} | EXTRA_COMMANDS
+
+
+def _jsonable(value):
+    """Converts results (containers, enums, times) to JSON types."""
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()
+                if not str(key).startswith("_")}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return str(value)
+
+
+def _snapshot(lamp):
+    return {
+        "is_on": lamp.is_on,
+        "mode": _jsonable(lamp.mode),
+        "color": _jsonable(lamp.color),
+        "brightness": lamp.brightness,
+        "temperature": lamp.temperature,
+    }
+
+
+class Daemon:
+    """Serves the commands of clients, keeping their lamps connected.
+
+    lamp_factory creates the Lamp for a MAC, by default with
+    keep_connection=True. Lamps are created on their first request.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, lamp_factory=None):
+        self.path = path
+        self._lamp_factory = lamp_factory or self._default_lamp
+        self._lamps = {}
+        self._watchers = {}  # mac -> queues of the watching clients
+        self._lock = threading.Lock()
+        self._commands = _commands()
+        self._server = None
+
+    @staticmethod
+    def _default_lamp(mac):
+        from .lamp import Lamp
+        return Lamp(mac, keep_connection=True)
+
+    def lamp(self, mac):
+        mac = mac.lower()
+        with self._lock:
+            lamp = self._lamps.get(mac)
+            if lamp is None:
+                lamp = self._lamps[mac] = self._lamp_factory(mac)
+                self._publish_states(mac, lamp)
+            return lamp
+
+    def _publish_states(self, mac, lamp):
+        """Passes the states the lamp reports on to its watchers."""
+        status_cb = lamp._status_cb
+
+        def _status(lamp):
+            if status_cb is not None:
+                status_cb(lamp)
+            with self._lock:
+                watchers = list(self._watchers.get(mac, []))
+            for states in watchers:
+                states.put(_snapshot(lamp))
+
+        lamp._status_cb = _status
+
+    def watch(self, mac, send):
+        """Sends the responses of a watch request, starting with the current
+        state, until sending fails."""
+        mac = mac.lower()
+        lamp = self.lamp(mac)
+        states = queue.Queue()
+        with self._lock:
+            self._watchers.setdefault(mac, []).append(states)
+        try:
+            try:
+                with lamp:
+                    lamp.state()
+            except Exception as ex:
+                _LOGGER.warning("Unable to watch %s: %s", mac, ex)
+                send({"ok": False, "error": "%s: %s" % (type(ex).__name__, ex)})
+                return
+            while True:
+                try:
+                    state = states.get(timeout=WATCH_POLL_INTERVAL)
+                except queue.Empty:
+                    with lamp:
+                        conn = lamp._conn
+                        if conn is not None and not conn.pushes_notifications:
+                            conn.poll()
+                    continue
+                send({"ok": True, "result": None, "lamp": state})
+        except OSError:
+            pass  # the client is gone
+        finally:
+            with self._lock:
+                self._watchers[mac].remove(states)
+
+    def warm_up(self, macs):
+        """Connects the given lamps in the background."""
+        def _connect(mac):
+            try:
+                with self.lamp(mac) as lamp:
+                    lamp.state()
+                _LOGGER.info("Connected to %s", mac)
+            except Exception as ex:
+                _LOGGER.warning("Unable to connect to %s: %s", mac, ex)
+
+        for mac in macs:
+            threading.Thread(target=_connect, args=(mac,), daemon=True).start()
+
+    def handle(self, request):
+        """Executes a request, returns the response."""
+        try:
+            mac = request["mac"]
+            command = request["command"]
+            if command not in self._commands:
+                raise ValueError("Unknown command %s" % command)
+            lamp = self.lamp(mac)
+            with lamp:
+                result = getattr(lamp, command)(*request.get("args", []),
+                                                **request.get("kwargs", {}))
+                if command.startswith("iter_"):
+                    result = list(result)
+            return {"ok": True, "result": _jsonable(result),
+                    "lamp": _snapshot(lamp)}
+        except Exception as ex:
+            _LOGGER.warning("%s failed: %s", request, ex)
+            return {"ok": False, "error": "%s: %s" % (type(ex).__name__, ex)}
+
+    def serve_forever(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            if is_running(self.path):
+                raise DaemonError("Already running on %s" % self.path)
+            os.unlink(self.path)
+
+        old_umask = os.umask(0o077)  # only for the current user
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon = self
+        _LOGGER.info("Listening on %s", self.path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.path)
+            self.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        with self._lock:
+            lamps, self._lamps = list(self._lamps.values()), {}
+        for lamp in lamps:
+            try:
+                lamp.disconnect()
+            except Exception as ex:
+                _LOGGER.debug("Unable to disconnect %s: %s", lamp.mac, ex)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError as ex:
+                response = {"ok": False, "error": "Invalid request: %s" % ex}
+            else:
+                if request.get("command") == WATCH and "mac" in request:
+                    self.server.daemon.watch(request["mac"], self._send)
+                    return
+                response = self.server.daemon.handle(request)
+            self._send(response)
+
+    def _send(self, response):
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+def is_running(path=DEFAULT_SOCKET):
+    """Returns True if a daemon is listening on path."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+class Client:
+    """Connection to the daemon, shareable between threads."""
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=60):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def call(self, mac, command, *args, **kwargs):
+        """Returns the result and the state of the lamp."""
+        request = {"mac": mac, "command": command, "args": list(args),
+                   "kwargs": kwargs}
+        with self._lock:
+            self._file.write(json.dumps(request).encode("utf-8") + b"\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise DaemonError("The daemon closed the connection")
+        response = json.loads(line.decode("utf-8"))
+        if not response["ok"]:
+            raise DaemonError(response["error"])
+        return response["result"], response["lamp"]
+
+    def watch(self, mac):
+        """Yields the state of the lamp whenever it reports it.
+
+        Takes over the connection, which is not usable for anything else
+        afterwards."""
+        request = {"mac": mac, "command": WATCH}
+        with self._lock:
+            self._sock.settimeout(None)
+            self._file.write(json.dumps(request).encode("utf-8") + b"\n")
+            self._file.flush()
+            for line in self._file:
+                response = json.loads(line.decode("utf-8"))
+                if not response["ok"]:
+                    raise DaemonError(response["error"])
+                yield response["lamp"]
+        raise DaemonError("The daemon closed the connection")
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RemoteLamp:
+    """Stand-in for a Lamp, forwarding its commands to the daemon."""
+
+    def __init__(self, mac, client, status_cb=None):
+        self._mac = mac
+        self._client = client
+        self._status_cb = status_cb
+        self._state = {}
+
+    @property
+    def mac(self):
+        return self._mac
+
+    def __getattr__(self, name):
+        if name in ("is_on", "mode", "color", "brightness", "temperature"):
+            return self._state.get(name)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        # the daemon checks whether it is a command
+
+        def _command(*args, **kwargs):
+            result, self._state = self._client.call(self._mac, name,
+                                                    *args, **kwargs)
+            return result
+
+        return _command
+
+    def wait_for_notifications(self):
+        """Calls status_cb with every state the lamp reports, forever."""
+        for state in self._client.watch(self._mac):
+            self._state = state
+            if self._status_cb:
+                self._status_cb(self)
+
+    def __str__(self):
+        return "<RemoteLamp %s is_on(%s) mode(%s) rgb(%s) brightness(%s) colortemp(%s)>" % (
+            self._mac, self.is_on, self.mode, self.color, self.brightness,
+            self.temperature)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return
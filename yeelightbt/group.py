@@ -0,0 +1,107 @@
+""" Controlling multiple lamps at once. """
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .lamp import Lamp
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class GroupResult:
+    """Per-lamp outcome of a group command."""
+
+    def __init__(self, command):
+        self.command = command
+        self.results = {}
+        self.errors = {}
+        self.durations = {}
+
+    @property
+    def succeeded(self):
+        return not self.errors
+
+    def __iter__(self):
+        """Yields (mac, result, exception, duration) for each lamp."""
+        for mac in self.durations:
+            yield (mac, self.results.get(mac), self.errors.get(mac),
+                   self.durations[mac])
+
+    def __str__(self):
+        return "<GroupResult %s ok(%s) failed(%s)>" % (
+            self.command, len(self.results), len(self.errors))
+
+
+class LampGroup:
+    """Fans out commands to many lamps concurrently.
+
+    Every lamp is used through its context manager, so commands to a single
+    lamp are still serialized by its lock, while at most max_workers lamps
+    are talked to at the same time. All Lamp commands are available:
+
+        group = LampGroup([Lamp(mac, keep_connection=True) for mac in macs])
+        res = group.set_color(255, 0, 0, 50)
+        for mac, result, error, duration in res:
+            ...
+    """
+
+    def __init__(self, lamps, max_workers=8):
+        self._lamps = list(lamps)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def lamps(self):
+        return self._lamps
+
+    @property
+    def macs(self):
+        return [lamp.mac for lamp in self._lamps]
+
+    def __len__(self):
+        return len(self._lamps)
+
+    def __getattr__(self, name):
+        if not hasattr(getattr(Lamp, name, None), "builder"):
+            raise AttributeError(name)
+
+        def _command(*args, **kwargs):
+            return self.run(name, *args, **kwargs)
+
+        return _command
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def run(self, command, *args, **kwargs):
+        """Runs the given Lamp method on all lamps, returns a GroupResult."""
+        res = GroupResult(command)
+        futures = [(lamp, self._executor.submit(self._call, lamp, command,
+                                                args, kwargs))
+                   for lamp in self._lamps]
+        for lamp, future in futures:
+            start, end, result, ex = future.result()
+            res.durations[lamp.mac] = end - start
+            if ex is None:
+                res.results[lamp.mac] = result
+            else:
+                _LOGGER.warning("%s failed on %s: %s", command, lamp.mac, ex)
+                res.errors[lamp.mac] = ex
+
+        return res
+
+    @staticmethod
+    def _call(lamp, command, args, kwargs):
+        start = time.monotonic()
+        try:
+            with lamp:
+                result = getattr(lamp, command)(*args, **kwargs)
+        except Exception as ex:
+            return start, time.monotonic(), None, ex
+
+        return start, time.monotonic(), result, None
@@ -0,0 +1,66 @@
+""" Cache for the GATT handles of the lamps. """
+import json
+import logging
+import os
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HandleCache:
+    """Remembers the notify, control and CCCD handles per MAC.
+
+    With path given, the handles are also stored as JSON on disk, so that
+    they survive restarts.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._handles = {}
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                self._handles = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as ex:
+            _LOGGER.warning("Unable to read handle cache %s: %s", self._path, ex)
+
+    def _save(self):
+        directory = os.path.dirname(self._path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = "%s.tmp" % self._path
+            with open(tmp, "w") as f:
+                json.dump(self._handles, f, indent=2, sort_keys=True)
+            os.replace(tmp, self._path)
+        except OSError as ex:
+            _LOGGER.warning("Unable to write handle cache %s: %s", self._path, ex)
+
+    def get(self, mac):
+        """Returns a dict with notify, control and cccd handles, or None."""
+        with self._lock:
+            handles = self._handles.get(mac.lower())
+            return dict(handles) if handles else None
+
+    def set(self, mac, notify, control, cccd):
+        handles = {"notify": notify, "control": control, "cccd": cccd}
+        with self._lock:
+            if self._handles.get(mac.lower()) == handles:
+                return
+            self._handles[mac.lower()] = handles
+            if self._path is not None:
+                self._save()
+
+    def invalidate(self, mac):
+        with self._lock:
+            if self._handles.pop(mac.lower(), None) and self._path is not None:
+                self._save()
+
+
+DEFAULT_HANDLE_CACHE = HandleCache()
@@ -1,54 +1,173 @@
 import struct
 import codecs
+import functools
 import logging
 import time
 import threading
-from .connection import BTLEConnection
-from .structures import Request, Response, StateResult
+from collections import namedtuple
+from .codec import DEFAULT_CODEC, FrameTemplate
+from .handlecache import DEFAULT_HANDLE_CACHE
+from .metrics import DEFAULT_METRICS
+from .retry import (DEFAULT_RETRY_POLICY, NO_RETRY, NOT_REPLAYABLE,
+                    CircuitBreaker, ResponseTimeout)
+from .structures import LampMode, StateResult, RESPONSE_FOR_REQUEST
 
 _LOGGER = logging.getLogger(__name__)
 
-def cmd(cmd):
-    def _wrap(self, *args, **kwargs):
-        req = cmd(self, *args, **kwargs)
+# changes the lamp answers with a StateResult notification
+NOTIFIED_CHANGES = {"SetOnOff", "SetColor", "SetBrightness", "SetTemperature"}
+
+class _Waiter:
+    """Collects the responses of the given type for a pending query.
+
+    True while there are results which have not been consumed yet."""
+    def __init__(self, type_):
+        self.type = type_
+        self.results = []
+        self.consumed = 0
+
+    def __bool__(self):
+        return len(self.results) > self.consumed
+
+
+class _Cached:
+    """Returned by a command to answer without a request."""
+    def __init__(self, value):
+        self.value = value
+
 
-        params = None
-        wait = self._wait_after_call
-        if isinstance(req, tuple):
-            params = req[1]
-            req = req[0]
+def _prepare(lamp, req):
+    """Converts the return value of a command to a request frame.
 
+    Returns the request type, the query for logging, the frame,
+    the time to wait after a write and the expected response type."""
+    params = None
+    wait = lamp._wait_after_call
+    if isinstance(req, tuple):
+        params = req[1]
+        req = req[0]
+
+    if isinstance(params, (bytes, bytearray)):
+        # already filled in from a frame template
+        query = req
+        request_bytes = params
+    else:
         query = {"type": req}
+        if params and "wait" in params:
+            wait = params["wait"]
+            del params["wait"]
         if params:
-            if "wait" in params:
-                wait = params["wait"]
-                del params["wait"]
             query["payload"] = params
+            request_bytes = lamp._codec.build_request(query)
+        else:
+            request_bytes = lamp._codec.constant_request(req)
 
-        _LOGGER.debug(">> %s (wait: %s)", query, wait)
-        _ex = None
-        try_count = 3
-        while try_count > 0:
-            try:
-                request_bytes = Request.build(query)
-                res = self.control_char.write(request_bytes,
-                                              withResponse=True)
-                self._conn.wait(wait)
+    expected = RESPONSE_FOR_REQUEST.get(req)
+    if expected is None:
+        # the known state is outdated until the lamp reports the change
+        lamp._state_time = None
+        if req in NOTIFIED_CHANGES:
+            with lamp._changes_lock:
+                lamp._pending_changes += 1
 
-                return res
-            except Exception as ex:
-                _LOGGER.error("got exception on %s, tries left %s: %s",
-                              query, try_count, ex)
-                raise
-                _ex = ex
-                try_count -= 1
-                self.connect()
-                continue
-        raise _ex
+    return req, query, request_bytes, wait, expected
 
+
+def cmd(cmd):
+    @functools.wraps(cmd)
+    def _wrap(self, *args, **kwargs):
+        req = cmd(self, *args, **kwargs)
+        if req is None:
+            # nothing to be done, see suppress_unchanged
+            return None
+        if isinstance(req, _Cached):
+            return req.value
+        req, query, request_bytes, wait, expected = _prepare(self, req)
+
+        _LOGGER.debug(">> %s (wait: %s, expecting: %s)", query, wait, expected)
+
+        def _request():
+            waiter = None
+            if expected:
+                # registered before writing, the response may arrive
+                # already while waiting for the write to be acknowledged.
+                waiter = self._waiters[expected] = _Waiter(expected)
+            try:
+                start = time.monotonic()
+                res = self._conn.make_request(self.control_handle,
+                                              request_bytes,
+                                              with_response=True)
+                self._count("writes", req)
+                self._observe("write_seconds", req, time.monotonic() - start)
+                if waiter is None:
+                    self._conn.wait(wait)
+                    return res
+
+                if not self._conn.wait_for(waiter, self._response_timeout):
+                    raise ResponseTimeout("No %s received for %s in %s seconds"
+                                          % (expected, query,
+                                             self._response_timeout))
+
+                self._observe("response_seconds", req, time.monotonic() - start)
+                return waiter.results[0]
+            finally:
+                if waiter is not None:
+                    self._waiters.pop(expected, None)
+
+        try:
+            return self._call(_request, replayable=req not in NOT_REPLAYABLE,
+                              type_=req)
+        except ResponseTimeout as ex:
+            _LOGGER.warning("%s", ex)
+            return None
+
+    # allows AsyncLamp to reuse the request building
+    _wrap.builder = cmd
     return _wrap
 
 
+# longest part of a name fitting into a frame
+NAME_PART_LENGTH = 13
+# id of the entry ending a list
+END_OF_LIST = 0xff
+
+
+def _list_end(number, id_field):
+    """Returns whether a response ends the list of the given number."""
+    def _is_last(res):
+        return number != END_OF_LIST or res[id_field] == END_OF_LIST
+
+    return _is_last
+
+
+def _is_last_name_part(res):
+    return res.index >= res.id or len(res.text) < NAME_PART_LENGTH
+
+# longest step of a flow in seconds, and most colors of a simple flow
+MAX_FLOW_STEP_DURATION = 600
+SIMPLE_FLOW_COLORS = 4
+
+# A step of a flow, changing to either the rgb color or the temperature
+# at the brightness within duration seconds.
+FlowStep = namedtuple("FlowStep", "duration rgb temperature brightness",
+                      defaults=(None, None, 100))
+
+
+def _flow_step(step):
+    """Returns the FlowStep for a FlowStep, sequence or dictionary."""
+    if isinstance(step, dict):
+        step = FlowStep(**step)
+    elif not isinstance(step, FlowStep):
+        step = FlowStep(*step)
+    if (step.rgb is None) == (step.temperature is None):
+        raise ValueError("A flow step needs either a color or a temperature: %s"
+                         % (step,))
+    if not 0 <= step.duration <= MAX_FLOW_STEP_DURATION:
+        raise ValueError("The duration of a flow step must be 0-%s seconds: %s"
+                         % (MAX_FLOW_STEP_DURATION, step))
+    return step
+
+
 class Lamp:
     REGISTER_NOTIFY_HANDLE = 0x16
     MAIN_UUID =   "8e2f0cbd-1a66-4b53-ace6-b494e25f87bd"
@@ -56,19 +175,50 @@ class Lamp:
     CONTROL_UUID = "aa7d3f34-2d4f-41e0-807f-52fbf8cf7443"
 
     def __init__(self, mac, status_cb=None, paired_cb=None,
-                 keep_connection=False, wait_after_call=0):
+                 keep_connection=False, wait_after_call=0, codec=None,
+                 response_timeout=2, transport=None, pool=None,
+                 handle_cache=DEFAULT_HANDLE_CACHE,
+                 retry_policy=DEFAULT_RETRY_POLICY, circuit_breaker=True,
+                 suppress_unchanged=None, metrics=DEFAULT_METRICS):
         self._mac = mac
         self._is_on = False
         self._brightness = None
         self._temperature = None
         self._rgb = None
         self._mode = None
+        self._state = None
+        self._state_time = None
+        # written changes whose StateResult has not arrived yet, the states
+        # reported before that are outdated
+        self._pending_changes = 0
+        self._changes_lock = threading.Lock()
+        self._suppress_unchanged = suppress_unchanged
+        self._metrics = metrics
+        self.suppressed_writes = 0
         self._paired_cb = paired_cb
         self._status_cb = status_cb
         self._keep_connection = keep_connection
         self._wait_after_call = wait_after_call
+        self._response_timeout = response_timeout
+        self._waiters = {}
         self._lock = threading.RLock()
         self._conn = None
+        # BTLEConnection if None, imported when connecting
+        self._transport = transport
+        self._pool = pool
+        self._handle_cache = handle_cache
+        self._transport_errors = None
+        self._retry_policy = retry_policy or NO_RETRY
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        self._breaker = circuit_breaker or None
+        self._connecting = False
+        self._codec = codec or DEFAULT_CODEC
+        # per lamp, as the frames are reused between the calls
+        self._onoff_frame = FrameTemplate("SetOnOff", ">B")
+        self._color_frame = FrameTemplate("SetColor", ">BBBBB")
+        self._brightness_frame = FrameTemplate("SetBrightness", ">B")
+        self._temperature_frame = FrameTemplate("SetTemperature", ">HB")
 
     @property
     def mac(self):
@@ -82,46 +232,180 @@ class Lamp:
     def mode(self):
         return self._mode
 
+    @property
+    def circuit_breaker(self):
+        return self._breaker
+
+    def _get_transport(self):
+        if self._transport is None:
+            from .connection import BTLEConnection
+            self._transport = BTLEConnection
+        return self._transport
+
+    @property
+    def _errors(self):
+        """Exceptions of the transport worth retrying."""
+        if self._transport_errors is None:
+            self._transport_errors = tuple(
+                getattr(self._get_transport(), "errors", ()))
+        return self._transport_errors
+
+    def _count(self, name, type_=None, amount=1):
+        if self._metrics is not None:
+            self._metrics.increment(name, self._mac, type_, amount)
+
+    def _observe(self, name, type_, seconds):
+        if self._metrics is not None:
+            self._metrics.observe(name, self._mac, type_, seconds)
+
+    def _call(self, func, replayable=True, reconnect=True, type_=None):
+        """Runs func according to the retry policy and the circuit breaker.
+
+        Transport errors reconnect before the next attempt and count as
+        failures of the circuit. A missing response is neither retried nor
+        a failure, the lamp acknowledged the write after all."""
+        if self._connecting:
+            # connect() is retried as a whole
+            return func()
+
+        if self._breaker is not None:
+            self._breaker.check(self._mac)
+        policy = self._retry_policy if replayable else NO_RETRY
+
+        def _before_retry(ex):
+            self._count("retries", type_)
+            if reconnect:
+                self._reconnect(ex)
+
+        try:
+            res = policy.call(func, self._errors, _before_retry)
+        except ResponseTimeout:
+            if self._breaker is not None:
+                self._breaker.success()
+            raise
+        except BaseException as ex:
+            if self._breaker is not None:
+                if isinstance(ex, self._errors):
+                    self._breaker.failure()
+                else:
+                    # says nothing about the link, but ends a trial
+                    self._breaker.release()
+            raise
+
+        if self._breaker is not None:
+            self._breaker.success()
+        return res
+
+    def _reconnect(self, ex):
+        _LOGGER.info("reconnecting to %s after: %s", self._mac, ex)
+        self._count("reconnects")
+        self._connect()
+
     def connect(self):
+        self._call(self._connect, reconnect=False, type_="connect")
+
+    def _connect(self):
+        self._connecting = True
+        try:
+            self._setup_connection()
+        finally:
+            self._connecting = False
+
+    def _setup_connection(self):
         if self._conn:
-            self._conn.disconnect()
-        self._conn = BTLEConnection(self._mac)
+            try:
+                self._conn.disconnect()
+            except Exception as ex:
+                _LOGGER.debug("unable to close the old connection: %s", ex)
+        self._conn = self._get_transport()(self._mac)
         self._conn.connect()
+        with self._changes_lock:
+            # nothing written before is going to be reported anymore
+            self._pending_changes = 0
+            self._state_time = None
+
+        handles = None
+        if self._handle_cache is not None:
+            handles = self._handle_cache.get(self._mac)
+        if handles:
+            _LOGGER.debug("using cached handles: %s", handles)
+            try:
+                # a pairing response is only received with valid handles
+                if self._setup(handles["notify"], handles["control"],
+                               handles["cccd"]) is not None:
+                    return
+            except Exception as ex:
+                if (isinstance(ex, self._errors) and not
+                        isinstance(ex, getattr(self._conn, "handle_errors", ()))):
+                    # the connection broke, not the handles
+                    raise
+                _LOGGER.debug("cached handles failed: %s", ex)
+            _LOGGER.info("cached handles for %s are not valid, discovering",
+                         self._mac)
+            self._handle_cache.invalidate(self._mac)
 
         notify_char = self._conn.get_characteristics(Lamp.NOTIFY_UUID)
-        self.notify_handle = notify_char.pop().getHandle()
-        _LOGGER.debug("got notify handle: %s" % self.notify_handle)
-        self._conn.set_callback(self.notify_handle, self.handle_notification)
+        notify_handle = notify_char.pop().getHandle()
+        _LOGGER.debug("got notify handle: %s" % notify_handle)
 
         control_chars = self._conn.get_characteristics(Lamp.CONTROL_UUID)
         self.control_char = control_chars.pop()
-        self.control_handle = self.control_char.getHandle()
-        _LOGGER.debug("got control handle: %s" % self.control_handle)
+        control_handle = self.control_char.getHandle()
+        _LOGGER.debug("got control handle: %s" % control_handle)
+
+        res = self._setup(notify_handle, control_handle,
+                          self.REGISTER_NOTIFY_HANDLE)
+        if res is not None and self._handle_cache is not None:
+            self._handle_cache.set(self._mac, notify_handle, control_handle,
+                                   self.REGISTER_NOTIFY_HANDLE)
+
+    def _setup(self, notify_handle, control_handle, cccd_handle):
+        """Registers for notifications and pairs, returns the pairing result."""
+        self.notify_handle = notify_handle
+        self.control_handle = control_handle
+        self._conn.set_callback(self.notify_handle, self.handle_notification)
 
         # We need to register to receive notifications
-        self._conn.make_request(self.REGISTER_NOTIFY_HANDLE,
+        self._conn.make_request(cccd_handle,
                                 struct.pack("<BB", 0x01, 0x00),
                                 timeout=None)
-        self.pair()
+        self._count("pairings")
+        return self.pair()
 
     def wait_for_notifications(self):
         while True:
             self._conn.wait(1)
 
     def disconnect(self):
-        self._conn.disconnect()
+        if self._conn:
+            self._conn.disconnect()
+            self._conn = None
+
+    @property
+    def connected(self):
+        return self._conn is not None
 
     def __enter__(self):
         self._lock.acquire()
-        if not self._conn and self._keep_connection:
-            self.connect()
+        try:
+            if self._pool is not None:
+                self._pool.acquire(self)
+            elif not self._conn and self._keep_connection:
+                self.connect()
+        except Exception:
+            self._lock.release()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._lock.release()
-        if not self._keep_connection:
-            _LOGGER.info("not keeping the connection, disconnecting..")
-            self._conn.disconnect()
+        try:
+            if self._pool is not None:
+                self._pool.release(self)
+            elif not self._keep_connection:
+                _LOGGER.info("not keeping the connection, disconnecting..")
+                self.disconnect()
+        finally:
+            self._lock.release()
 
         return
 
@@ -130,25 +414,48 @@ class Lamp:
         return "Pair"
 
     def wait(self, sec):
-        end = time.time() + sec
-        while time.time() < end:
-            self._conn.wait(0.1)
+        self._conn.wait(sec)
 
     @property
     def is_on(self):
         return self._is_on
 
+    def _unchanged(self, is_on=True, mode=None, **values):
+        """Returns True if the last state already has the given values.
+
+        Only used with suppress_unchanged, and only with a state received
+        within that many seconds, after all written changes were reported."""
+        if self._suppress_unchanged is None:
+            return False
+        age = self.state_age
+        if age is None or age > self._suppress_unchanged:
+            return False
+        if self._is_on != is_on or (mode is not None and self._mode != mode):
+            return False
+        for name, value in values.items():
+            if value is not None and getattr(self, "_" + name) != value:
+                return False
+
+        _LOGGER.debug("%s already in the requested state, not writing", self._mac)
+        self.suppressed_writes += 1
+        self._count("suppressed_writes")
+        return True
+
     @cmd
     def turn_on(self):
-        return "SetOnOff", {"state": True}
+        if self._unchanged(is_on=True):
+            return None
+        return "SetOnOff", self._onoff_frame.fill(0x01)
 
     @cmd
     def turn_off(self):
-        return "SetOnOff", {"state": False}
+        if self._unchanged(is_on=False):
+            return None
+        return "SetOnOff", self._onoff_frame.fill(0x02)
 
     @cmd
     def get_name(self):
-        return "GetName", {"wait": 0.5}
+        return "GetName"
 
     @cmd
     def get_scene(self, scene_id):
@@ -195,40 +502,227 @@ class Lamp:
         return self._temperature
 
     @cmd
-    def set_temperature(self, kelvin: int, brightness: int):
-        return "SetTemperature", {"temperature": kelvin, "brightness": brightness}
+    def set_temperature(self, kelvin: int, brightness: int = None):
+        if self._unchanged(mode=LampMode.White, temperature=kelvin,
+                           brightness=brightness):
+            return None
+        return "SetTemperature", self._temperature_frame.fill(
+            kelvin, self._keep_brightness(brightness, 255))
 
     @property
     def brightness(self):
         return self._brightness
 
+    def _keep_brightness(self, brightness, unset):
+        """Returns the brightness to send along a color or temperature.
+
+        Without one, the last reported brightness is kept. Before any state
+        was received, unset is sent, which is out of the 1-100 range and
+        ignored by the lamp."""
+        if brightness is not None:
+            return brightness
+        if self._brightness is not None:
+            return self._brightness
+        return unset
+
     @cmd
     def set_brightness(self, brightness: int):
-        return "SetBrightness", {"brightness": brightness}
+        if self._unchanged(brightness=brightness):
+            return None
+        return "SetBrightness", self._brightness_frame.fill(brightness)
 
     @property
     def color(self):
         return self._rgb
 
     @cmd
-    def set_color(self, red: int, green: int, blue: int, brightness: int):
-        return "SetColor", {"red": red, "green": green, "blue": blue, "brightness": brightness}
+    def set_color(self, red: int, green: int, blue: int, brightness: int = None):
+        if self._unchanged(mode=LampMode.Color, brightness=brightness or None,
+                           rgb=(red or 0, green or 0, blue or 0, 0)):
+            return None
+        return "SetColor", self._color_frame.fill(red or 0, green or 0, blue or 0,
+                                                  0, self._keep_brightness(brightness, 0))
+
+    @staticmethod
+    def plan(on=None, rgb=None, temperature=None, brightness=None):
+        """Returns the fewest commands reaching the given target state.
+
+        The result is a list of (method name, arguments). Setting a color,
+        temperature or brightness also turns the lamp on, and the brightness
+        is carried in the color and temperature frames. Without a
+        brightness, those keep the current one."""
+        if on is False:
+            return [("turn_off", ())]
+        if rgb is not None:
+            if temperature is not None:
+                _LOGGER.warning("Both color and temperature given, using the color")
+            return [("set_color", tuple(rgb) + (brightness,))]
+        if temperature is not None:
+            return [("set_temperature", (temperature, brightness))]
+        if brightness is not None:
+            return [("set_brightness", (brightness,))]
+        if on:
+            return [("turn_on", ())]
+        return []
+
+    def apply(self, on=None, rgb=None, temperature=None, brightness=None):
+        """Moves the lamp to the given state, see plan().
+
+        Returns the results of the executed commands."""
+        return [getattr(self, name)(*args)
+                for name, args in self.plan(on, rgb, temperature, brightness)]
+
+    @property
+    def state_age(self):
+        """Seconds since the last reported state, None if outdated."""
+        if self._state_time is None or self._pending_changes:
+            return None
+        return time.monotonic() - self._state_time
 
     @cmd
-    def state(self) -> StateResult:
-        return "GetState", {"wait": 0.5}
+    def state(self, max_age=None) -> StateResult:
+        """Requests the state, or with max_age returns the last reported
+        state if it is at most that many seconds old."""
+        age = self.state_age
+        if max_age is not None and age is not None and age <= max_age:
+            return _Cached(self._state)
+        return "GetState"
 
     @cmd
     def get_alarm(self, number):
-        return "GetAlarm", {"id": number, "wait": 0.5}
+        return "GetAlarm", {"id": number}
 
     @cmd
     def get_flow(self, number):
-        return "GetSimpleFlow", {"id": number, "wait": 0.5}
+        return "GetSimpleFlow", {"id": number}
+
+    @cmd
+    def set_flow_step(self, flow_id, index, step):
+        step = _flow_step(step)
+        payload = {"id": flow_id, "pkt_num": index, "cmd": "Set",
+                   "brightness": step.brightness, "time": step.duration}
+        if step.rgb is not None:
+            payload["rgb_mode"] = "Color"
+            payload["red"], payload["green"], payload["blue"] = step.rgb
+        else:
+            payload["rgb_mode"] = "Temperature"
+            payload["temperature"] = step.temperature
+        return "SetFlow", payload
+
+    @cmd
+    def start_flow(self, flow_id):
+        return "SetFlow", {"id": flow_id, "cmd": "Start"}
+
+    @cmd
+    def stop_flow(self, flow_id):
+        return "SetFlow", {"id": flow_id, "cmd": "Stop"}
+
+    @cmd
+    def store_flow(self, flow_id):
+        return "SetFlow", {"id": flow_id, "cmd": "Store"}
+
+    @cmd
+    def set_simple_flow(self, flow_id, colors, duration, control=0):
+        """Sets a flow through up to four colors, duration is 0-255."""
+        if not 1 <= len(colors) <= SIMPLE_FLOW_COLORS:
+            raise ValueError("A simple flow has 1-%s colors" % SIMPLE_FLOW_COLORS)
+        payload = {"id": flow_id, "type": "Color", "time": duration,
+                   "control": control}
+        for name, rgb in zip(("first", "second", "third", "fourth"), colors):
+            payload[name] = dict(zip(("red", "green", "blue"), rgb))
+        return "SetSimpleFlow", payload
+
+    @staticmethod
+    def plan_flow(flow_id, steps, start=True, store=False):
+        """Returns the commands uploading a flow, see plan().
+
+        Raises ValueError for invalid steps before anything is written."""
+        steps = [_flow_step(step) for step in steps]
+        if not steps:
+            raise ValueError("A flow needs at least one step")
+        commands = [("set_flow_step", (flow_id, index, step))
+                    for index, step in enumerate(steps)]
+        if store:
+            commands.append(("store_flow", (flow_id,)))
+        if start:
+            commands.append(("start_flow", (flow_id,)))
+        return commands
+
+    def set_flow(self, flow_id, steps, start=True, store=False):
+        """Uploads a flow of FlowSteps, which the lamp then runs on its own.
+
+        Steps may also be given as tuples or dictionaries of the FlowStep
+        fields. With store the flow is kept on the lamp, with start it is
+        started right away."""
+        return [getattr(self, name)(*args)
+                for name, args in self.plan_flow(flow_id, steps, start, store)]
+
+    def _stream(self, req, is_last):
+        """Sends the request and yields its responses as they arrive,
+        until is_last(response) is true.
+
+        The request is not retried, stops with a warning if the next
+        response does not arrive within the response timeout."""
+        req, query, request_bytes, wait, expected = _prepare(self, req)
+
+        def _write():
+            start = time.monotonic()
+            self._conn.make_request(self.control_handle, request_bytes,
+                                    with_response=True)
+            self._count("writes", req)
+            self._observe("write_seconds", req, time.monotonic() - start)
+            return start
+
+        _LOGGER.debug(">> %s (streaming %s)", query, expected)
+        waiter = self._waiters[expected] = _Waiter(expected)
+        try:
+            start = self._call(_write, type_=req)
+            while True:
+                if not self._conn.wait_for(waiter, self._response_timeout):
+                    _LOGGER.warning("No further %s received for %s in %s seconds",
+                                    expected, query, self._response_timeout)
+                    return
+                res = waiter.results[waiter.consumed]
+                if not waiter.consumed:
+                    self._observe("response_seconds", req,
+                                  time.monotonic() - start)
+                waiter.consumed += 1
+                yield res
+                if is_last(res):
+                    return
+        finally:
+            self._waiters.pop(expected, None)
+
+    def _iter_list(self, req, number, id_field="id"):
+        for res in self._stream(req, _list_end(number, id_field)):
+            if res[id_field] != END_OF_LIST:
+                yield res
+
+    def iter_alarms(self, number=END_OF_LIST):
+        """Yields the alarms as they arrive, all of them by default."""
+        return self._iter_list(Lamp.get_alarm.builder(self, number), number)
+
+    def iter_scenes(self, number=END_OF_LIST):
+        """Yields the scenes as they arrive, all of them by default."""
+        return self._iter_list(Lamp.get_scene.builder(self, number), number,
+                               "scene_id")
+
+    def iter_flows(self, number=END_OF_LIST):
+        """Yields the flows as they arrive, all of them by default."""
+        return self._iter_list(Lamp.get_flow.builder(self, number), number)
+
+    def iter_name_parts(self):
+        """Yields the parts of the lamp's name as they arrive."""
+        return self._stream(Lamp.get_name.builder(self), _is_last_name_part)
+
+    def read_name(self):
+        """Returns the complete name of the lamp."""
+        parts = sorted(self.iter_name_parts(), key=lambda part: part.index)
+        return "".join(part.text for part in parts)
 
     @cmd
     def get_sleep(self):
-        return "GetSleepTimer", {"wait": 0.5}
+        return "GetSleepTimer"
 
     def __str__(self):
         return "<Lamp %s is_on(%s) mode(%s) rgb(%s) brightness(%s) colortemp(%s)>" % (
@@ -236,14 +730,28 @@ class Lamp:
 
     def handle_notification(self, data):
         _LOGGER.debug("<< %s", codecs.encode(data, 'hex'))
-        res = Response.parse(data)
+        try:
+            res = self._codec.parse_response(data)
+        except Exception:
+            self._count("parse_errors")
+            raise
+        self._count("notifications", str(res.type))
         payload = res.payload
+        waiter = self._waiters.get(res.type)
+        if waiter is not None:
+            waiter.results.append(payload)
+
         if res.type == "StateResult":
             self._is_on = payload.state
             self._mode = payload.mode
             self._rgb = (payload.red, payload.green, payload.blue, payload.white)
             self._brightness = payload.brightness
             self._temperature = payload.temperature
+            self._state = payload
+            with self._changes_lock:
+                if self._pending_changes:
+                    self._pending_changes -= 1
+                self._state_time = time.monotonic()
 
             if self._status_cb:
                 self._status_cb(self)
@@ -253,5 +761,7 @@ class Lamp:
             if self._paired_cb:
                 self._paired_cb(res)
 
-        else:
+        elif waiter is None:
             _LOGGER.info("Unhandled cb: %s", res)
+
+        return res
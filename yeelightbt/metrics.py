@@ -0,0 +1,154 @@
+"""
+Counters and latency histograms per lamp and request type.
+
+    lamp = Lamp(mac, metrics=DEFAULT_METRICS)
+    ...
+    print(DEFAULT_METRICS.prometheus())
+
+Anything with the increment() and observe() methods of Metrics can be
+passed as metrics to Lamp, e.g. to forward the values elsewhere.
+"""
+import threading
+
+# upper bounds in seconds
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DESCRIPTIONS = {
+    "writes": "Requests written to the lamp.",
+    "suppressed_writes": "Requests not written as they would not change anything.",
+    "notifications": "Notifications received from the lamp.",
+    "parse_errors": "Notifications which could not be parsed.",
+    "retries": "Retried requests and connection attempts.",
+    "reconnects": "Reconnections after a broken connection.",
+    "pairings": "Pairing requests.",
+    "write_seconds": "Time for a write to be acknowledged.",
+    "response_seconds": "Time from writing a request to its response.",
+}
+
+PREFIX = "yeelightbt_"
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """Yields (upper bound, count of values up to it)."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-quantile."""
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Collects the counters and histograms of any number of lamps."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        # (name, mac, type) -> value or Histogram
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, mac, type_=None, amount=1):
+        key = (name, mac, type_)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, mac, type_, seconds):
+        key = (name, mac, type_)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self._buckets)
+            histogram.observe(seconds)
+
+    def counter(self, name, mac=None, type_=None):
+        """Returns the sum of the matching counters, None matches all."""
+        with self._lock:
+            return sum(value for (name_, mac_, type__), value
+                       in self.counters.items()
+                       if name_ == name and mac in (None, mac_) and
+                       type_ in (None, type__))
+
+    def histogram(self, name, mac, type_=None):
+        with self._lock:
+            return self.histograms.get((name, mac, type_))
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def prometheus(self):
+        """Returns all values in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items(), key=_sort_key)
+            histograms = sorted(self.histograms.items(), key=_sort_key)
+
+        last = None
+        for (name, mac, type_), value in counters:
+            metric = "%s%s_total" % (PREFIX, name)
+            if name != last:
+                _header(lines, metric, name, "counter")
+                last = name
+            lines.append("%s%s %s" % (metric, _labels(mac, type_), value))
+
+        for (name, mac, type_), histogram in histograms:
+            metric = PREFIX + name
+            if name != last:
+                _header(lines, metric, name, "histogram")
+                last = name
+            for bound, total in histogram.cumulative():
+                lines.append("%s_bucket%s %s" % (
+                    metric, _labels(mac, type_, le=repr(float(bound))), total))
+            lines.append("%s_bucket%s %s" % (
+                metric, _labels(mac, type_, le="+Inf"), histogram.count))
+            lines.append("%s_sum%s %s" % (metric, _labels(mac, type_),
+                                          histogram.sum))
+            lines.append("%s_count%s %s" % (metric, _labels(mac, type_),
+                                            histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(item):
+    name, mac, type_ = item[0]
+    return name, mac or "", type_ or ""
+
+
+def _header(lines, metric, name, kind):
+    if name in DESCRIPTIONS:
+        lines.append("# HELP %s %s" % (metric, DESCRIPTIONS[name]))
+    lines.append("# TYPE %s %s" % (metric, kind))
+
+
+def _labels(mac, type_, **extra):
+    labels = [("mac", mac), ("type", type_)] + sorted(extra.items())
+    return "{%s}" % ",".join('%s="%s"' % (key, value)
+                             for key, value in labels if value is not None)
+
+
+DEFAULT_METRICS = Metrics()
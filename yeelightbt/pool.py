@@ -0,0 +1,182 @@
+""" Sharing a limited number of connections between many lamps. """
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection slot became free in time."""
+
+
+class ConnectionPool:
+    """Keeps up to max_connections lamps connected.
+
+    Lamps created with pool=... acquire their connection when entering
+    their context manager. When the pool is full, the least recently used
+    idle lamp gets disconnected, and lamps left idle for idle_timeout
+    seconds are disconnected in the background.
+    """
+
+    def __init__(self, max_connections=4, idle_timeout=60, wait_timeout=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._cond = threading.Condition()
+        # lamp -> time of last release, least recently used first
+        self._connected = OrderedDict()
+        self._in_use = set()
+        # taken out of _connected, being disconnected outside of _cond
+        self._closing = set()
+        self._closed = False
+
+        self._reaper = None
+        if idle_timeout:
+            self._reaper = threading.Thread(target=self._reap, daemon=True,
+                                            name="yeelightbt-pool-reaper")
+            self._reaper.start()
+
+    @property
+    def stats(self):
+        with self._cond:
+            return {
+                "connected": len(self._connected),
+                "in_use": len(self._in_use),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def acquire(self, lamp):
+        """Makes sure the lamp is connected, called with the lamp's lock held."""
+        with self._cond:
+            if lamp in self._connected and lamp.connected:
+                self.hits += 1
+                self._connected.move_to_end(lamp)
+                self._in_use.add(lamp)
+                return
+
+            self.misses += 1
+            self._connected.pop(lamp, None)
+            deadline = None
+            if self.wait_timeout is not None:
+                deadline = time.monotonic() + self.wait_timeout
+            while len(self._connected) + len(self._closing) >= self.max_connections:
+                evicted = self._evict()
+                if evicted is not None:
+                    self._cond.release()
+                    try:
+                        self._disconnect(evicted)
+                    finally:
+                        self._cond.acquire()
+                    continue
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted("No free connection for %s" % lamp.mac)
+                self._cond.wait(remaining)
+
+            # reserve the slot before connecting
+            self._connected[lamp] = time.monotonic()
+            self._in_use.add(lamp)
+
+        try:
+            lamp.connect()
+        except Exception:
+            with self._cond:
+                self._connected.pop(lamp, None)
+                self._in_use.discard(lamp)
+                self._cond.notify()
+            raise
+
+    def release(self, lamp):
+        with self._cond:
+            self._in_use.discard(lamp)
+            if lamp in self._connected:
+                if lamp.connected:
+                    self._connected[lamp] = time.monotonic()
+                    self._connected.move_to_end(lamp)
+                else:
+                    del self._connected[lamp]
+            self._cond.notify()
+
+    def _evict(self):
+        """Takes the least recently used idle lamp for disconnecting,
+        called with _cond held."""
+        for lamp in self._connected:
+            if lamp in self._in_use:
+                continue
+            if self._take(lamp):
+                _LOGGER.debug("Evicted %s", lamp.mac)
+                self.evictions += 1
+                return lamp
+        return None
+
+    def _take(self, lamp):
+        """Removes an idle lamp for _disconnect(), called with _cond held.
+
+        Its slot stays taken until it has been disconnected."""
+        # somebody may be just about to use it
+        if not lamp._lock.acquire(blocking=False):
+            return False
+        del self._connected[lamp]
+        self._closing.add(lamp)
+        return True
+
+    def _disconnect(self, lamp):
+        """Disconnects a lamp returned by _take(), called without _cond, so
+        that the slow disconnect does not hold up the other lamps."""
+        try:
+            lamp.disconnect()
+        except Exception as ex:
+            _LOGGER.warning("Unable to disconnect %s: %s", lamp.mac, ex)
+        finally:
+            lamp._lock.release()
+            with self._cond:
+                self._closing.discard(lamp)
+                self._cond.notify_all()
+
+    def expire(self):
+        """Disconnects lamps which have been idle for too long."""
+        expired = []
+        with self._cond:
+            limit = time.monotonic() - self.idle_timeout
+            for lamp, last_used in list(self._connected.items()):
+                if last_used > limit or lamp in self._in_use:
+                    continue
+                if self._take(lamp):
+                    _LOGGER.debug("Closing idle connection to %s", lamp.mac)
+                    self.expirations += 1
+                    expired.append(lamp)
+        for lamp in expired:
+            self._disconnect(lamp)
+
+    def _reap(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._cond.wait(self.idle_timeout / 2)
+                if self._closed:
+                    return
+            self.expire()
+
+    def close(self):
+        """Disconnects all idle lamps and stops the background expiration."""
+        with self._cond:
+            self._closed = True
+            idle = [lamp for lamp in list(self._connected)
+                    if lamp not in self._in_use and self._take(lamp)]
+            self._cond.notify_all()
+        for lamp in idle:
+            self._disconnect(lamp)
@@ -0,0 +1,136 @@
+""" Retrying failed requests and giving up on unreachable lamps. """
+import logging
+import random
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Requests which must not be sent twice, as their effect would be repeated.
+NOT_REPLAYABLE = {"AddBeacon", "FactoryReset", "TestMode"}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of talking to a lamp which failed too often."""
+
+
+class ResponseTimeout(Exception):
+    """Raised internally when a lamp does not answer to a query.
+
+    Not retried, and not a failure of the circuit."""
+
+
+class RetryPolicy:
+    """Describes how often and how fast failed requests are retried.
+
+    Retry n, i.e. attempt n + 1, waits backoff * 2 ** (n - 1) seconds
+    before being sent, at most max_backoff, randomized by +- jitter of that.
+    No attempt is started after deadline seconds. retry_on lists the
+    retryable exceptions, by default the errors of the lamp's transport.
+    """
+
+    def __init__(self, attempts=3, backoff=0.25, max_backoff=4, jitter=0.5,
+                 deadline=15, retry_on=None):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+
+    def delay(self, attempt):
+        """Returns the time to wait before the given attempt."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 2))
+        return delay * (1 + self.jitter * random.uniform(-1, 1))
+
+    def call(self, func, retryable=(), before_retry=None):
+        """Calls func until it succeeds or the retries are exhausted.
+
+        before_retry is called with the last exception before every retry,
+        failures in it count as a failed attempt."""
+        retryable = self.retry_on or retryable
+        start = time.monotonic()
+        attempt = 1
+        last = None
+        while True:
+            try:
+                if last is not None and before_retry is not None:
+                    before_retry(last)
+                return func()
+            except Exception as ex:
+                if attempt >= self.attempts or not isinstance(ex, retryable):
+                    raise
+                delay = self.delay(attempt + 1)
+                if (self.deadline is not None and
+                        time.monotonic() + delay - start > self.deadline):
+                    raise
+                _LOGGER.warning("Attempt %s of %s failed, retrying in %.2fs: %s",
+                                attempt, self.attempts, delay, ex)
+                last = ex
+                attempt += 1
+                time.sleep(delay)
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class CircuitBreaker:
+    """Stops using a lamp after failure_threshold failures in a row.
+
+    While open, requests fail immediately with CircuitOpen. After
+    reset_timeout seconds a single request is let through again, closing
+    the circuit when it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def check(self, name):
+        """Raises CircuitOpen if requests to name should not be made."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpen("%s failed %s times, not trying for %.0fs"
+                                  % (name, self.failures, max(remaining, 0)))
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    _LOGGER.warning("Opening the circuit after %s failures",
+                                    self.failures)
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Ends a request let through by check() without a verdict."""
+        with self._lock:
+            self._trial = False
+
+    def reset(self):
+        self.success()
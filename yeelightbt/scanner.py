@@ -0,0 +1,171 @@
+"""
+Discovering lamps.
+
+    for adv in scan(timeout=5, expect=["f8:24:41:xx:xx:xx"]):
+        print(adv.mac, adv.model, adv.rssi)
+
+Lamps are yielded as soon as their advertisement arrives, and the scan
+stops once all expected lamps have been seen. Seen lamps are remembered
+for a while, so that repeated discoveries are answered without scanning.
+"""
+import logging
+import threading
+import time
+
+from bluepy import btle
+
+_LOGGER = logging.getLogger(__name__)
+
+COMPLETE_LOCAL_NAME = 9
+
+# prefix of the advertised name -> model
+MODELS = {
+    "XMCTD_": "Bedlight lamp v1",
+    "yeelight_ms": "Candela",
+}
+
+# how often the scan checks whether it can stop
+_SLICE = 0.1
+
+
+def model_for(name):
+    """Returns the model for an advertised name, None if not a lamp."""
+    for prefix, model in MODELS.items():
+        if name and name.startswith(prefix):
+            return model
+    return None
+
+
+class Advertisement:
+    """Last advertisement seen from a lamp."""
+
+    def __init__(self, mac, name, rssi, seen=None):
+        self.mac = mac
+        self.name = name
+        self.rssi = rssi
+        self.seen = seen if seen is not None else time.monotonic()
+
+    @property
+    def model(self):
+        return model_for(self.name)
+
+    @property
+    def age(self):
+        return time.monotonic() - self.seen
+
+    def __str__(self):
+        return "<Advertisement %s %s (%s) rssi=%s>" % (
+            self.model, self.mac, self.name, self.rssi)
+
+
+class AdvertisementCache:
+    """Remembers the lamps seen during the last ttl seconds."""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._advertisements = {}
+        self._complete = None  # time of the last scan run to its end
+
+    def update(self, adv):
+        with self._lock:
+            self._advertisements[adv.mac] = adv
+
+    def get(self, mac):
+        """Returns the advertisement of mac if it is fresh, else None."""
+        with self._lock:
+            adv = self._advertisements.get(mac.lower())
+        if adv is None or adv.age > self.ttl:
+            return None
+        return adv
+
+    def all(self):
+        with self._lock:
+            advertisements = list(self._advertisements.values())
+        return [adv for adv in advertisements if adv.age <= self.ttl]
+
+    def mark_complete(self):
+        with self._lock:
+            self._complete = time.monotonic()
+
+    @property
+    def complete(self):
+        """True if a full scan has been done during the last ttl seconds."""
+        with self._lock:
+            return (self._complete is not None and
+                    time.monotonic() - self._complete <= self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._advertisements = {}
+            self._complete = None
+
+
+DEFAULT_ADVERTISEMENT_CACHE = AdvertisementCache()
+
+
+class _Delegate(btle.DefaultDelegate):
+    def __init__(self):
+        btle.DefaultDelegate.__init__(self)
+        self.found = []
+
+    def handleDiscovery(self, dev, isNewDev, isNewData):
+        name = dev.getValueText(COMPLETE_LOCAL_NAME)
+        if model_for(name) is not None:
+            self.found.append(Advertisement(dev.addr.lower(), name, dev.rssi))
+
+
+def scan(timeout=5, expect=None, cache=DEFAULT_ADVERTISEMENT_CACHE):
+    """Yields an Advertisement for each lamp as soon as it is seen.
+
+    With expect, a list of MACs, stops as soon as all of them have been
+    seen. Lamps found in the cache are yielded without scanning, and no
+    scan is done at all if the cache can answer completely.
+    """
+    expect = set(mac.lower() for mac in expect or [])
+    yielded = set()
+
+    if cache is not None:
+        if expect:
+            cached = [cache.get(mac) for mac in expect]
+            cached = [adv for adv in cached if adv is not None]
+        elif cache.complete:
+            cached = cache.all()
+        else:
+            cached = []
+        for adv in cached:
+            yielded.add(adv.mac)
+            yield adv
+        if (expect and expect <= yielded) or (not expect and cache.complete):
+            _LOGGER.debug("Answered from the advertisement cache")
+            return
+
+    delegate = _Delegate()
+    scanner = btle.Scanner().withDelegate(delegate)
+    end = time.monotonic() + timeout
+    scanner.start()
+    try:
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                if cache is not None and not expect:
+                    cache.mark_complete()
+                return
+            scanner.process(min(remaining, _SLICE))
+
+            found, delegate.found = delegate.found, []
+            for adv in found:
+                if cache is not None:
+                    cache.update(adv)
+                if adv.mac in yielded:
+                    continue
+                yielded.add(adv.mac)
+                yield adv
+
+            if expect and expect <= yielded:
+                return
+    finally:
+        try:
+            scanner.stop()
+        except btle.BTLEException as ex:
+            _LOGGER.debug("Unable to stop scanning: %s", ex)
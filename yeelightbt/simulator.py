@@ -0,0 +1,344 @@
+"""
+In-process simulation of Yeelight lamps.
+
+Allows exercising and benchmarking Lamp without any bluetooth hardware:
+
+    sim = Simulator(latency=0.03, jitter=0.01, loss=0.01)
+    lamp = Lamp("f8:24:41:00:00:01", transport=sim)
+    lamp.connect()
+    lamp.set_color(255, 0, 0, 50)
+    print(sim.lamps["f8:24:41:00:00:01"].red)
+"""
+import heapq
+import logging
+import random
+import struct
+import threading
+import time
+
+from .codec import FRAME_SIZE, HEADER
+from .structures import RequestType, ResponseType
+from .transport import Transport
+
+_LOGGER = logging.getLogger(__name__)
+
+CONTROL_HANDLE = 0x12
+NOTIFY_HANDLE = 0x15
+REGISTER_NOTIFY_HANDLE = 0x16
+
+NOTIFY_UUID = "8f65073d-9f57-4aaa-afea-397d19d5bbeb"
+CONTROL_UUID = "aa7d3f34-2d4f-41e0-807f-52fbf8cf7443"
+
+_REQUESTS = {value: name for name, value in RequestType.encmapping.items()}
+_RESPONSES = ResponseType.encmapping
+
+
+class SimulationError(Exception):
+    """Raised when a simulated connection fails."""
+
+
+class SimulatedHandleError(SimulationError):
+    """Raised when writing to a handle the simulated lamp does not have."""
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self._handle = handle
+
+    def getHandle(self):
+        return self._handle
+
+
+def _bcd(value):
+    return int(str(value), 16)
+
+
+def _frame(type_, fmt="", *values):
+    """Builds a padded response frame."""
+    data = struct.pack(">BB" + fmt, HEADER, _RESPONSES[type_], *values)
+    return data + bytes(FRAME_SIZE - len(data))
+
+
+class SimulatedLamp:
+    """State of a simulated lamp, answering to request frames."""
+
+    def __init__(self, mac, name="Yeelight Bedside"):
+        self.mac = mac
+        self.name = name
+        self.is_on = False
+        self.mode = 0x02  # white
+        self.red = 0
+        self.green = 0
+        self.blue = 0
+        self.white = 0
+        self.brightness = 50
+        self.temperature = 4000
+        self.paired = False
+        self.reachable = True
+        # id -> (hour, minute, action), see structures.Alarm
+        self.alarms = {1: (7, 30, 0x01), 2: (22, 0, 0x02)}
+        # id -> name
+        self.scenes = {1: "Reading"}
+        # id -> {index: step frame}, and the id of the running flow
+        self.flows = {}
+        self.simple_flows = {}
+        self.flow = None
+        self._mode_before_flow = self.mode
+        self.requests = 0
+
+    def state_frame(self):
+        return _frame("StateResult", "BBBBBBBH",
+                      0x01 if self.is_on else 0x02, self.mode,
+                      self.red, self.green, self.blue, self.white,
+                      self.brightness, self.temperature)
+
+    def handle_request(self, frame):
+        """Handles a request, returns a list of notification frames."""
+        self.requests += 1
+        if len(frame) != FRAME_SIZE or frame[0] != HEADER:
+            _LOGGER.warning("Invalid frame: %s", bytes(frame).hex())
+            return []
+
+        type_ = _REQUESTS.get(frame[1])
+        handler = getattr(self, "_handle_%s" % type_, None)
+        if handler is None:
+            _LOGGER.debug("Ignoring unsupported request %s", type_)
+            return []
+
+        return handler(frame)
+
+    def _handle_Pair(self, frame):
+        self.paired = True
+        return [_frame("PairingResult", "B", 0x02)]
+
+    def _handle_GetState(self, frame):
+        return [self.state_frame()]
+
+    def _handle_SetOnOff(self, frame):
+        self.is_on = frame[2] == 0x01
+        return [self.state_frame()]
+
+    def _handle_SetColor(self, frame):
+        self.red, self.green, self.blue, self.white, brightness = frame[2:7]
+        if brightness:
+            self.brightness = brightness
+        self.mode = 0x01
+        self.is_on = True
+        return [self.state_frame()]
+
+    def _handle_SetBrightness(self, frame):
+        self.brightness = frame[2]
+        self.is_on = True
+        return [self.state_frame()]
+
+    def _handle_SetTemperature(self, frame):
+        self.temperature, brightness = struct.unpack_from(">HB", frame, 2)
+        if 1 <= brightness <= 100:
+            self.brightness = brightness
+        self.mode = 0x02
+        self.is_on = True
+        return [self.state_frame()]
+
+    def _handle_SetFlow(self, frame):
+        id_, index, command = frame[2:5]
+        if command == 0x02:  # set
+            self.flows.setdefault(id_, {})[index] = bytes(frame[5:16])
+            return []
+        if command == 0x01 and id_ in self.flows:  # start
+            if self.flow is None:
+                self._mode_before_flow = self.mode
+            self.flow = id_
+            self.mode = 0x03
+            self.is_on = True
+        elif command == 0x03 and self.flow is not None:  # stop
+            self.flow = None
+            self.mode = self._mode_before_flow
+        else:
+            return []
+        return [self.state_frame()]
+
+    def _handle_SetSimpleFlow(self, frame):
+        self.simple_flows[frame[2]] = bytes(frame[3:18])
+        return []
+
+    def _handle_GetName(self, frame):
+        text = self.name.encode("ascii")
+        parts = [text[i:i + 13] for i in range(0, len(text), 13)] or [b""]
+        return [_frame("GetNameResult", "BBB%ss" % len(part),
+                       len(parts) - 1, index, len(part), part)
+                for index, part in enumerate(parts)]
+
+    def _list(self, frame, entries, build):
+        """Answers with the requested entry or all entries and an end marker."""
+        id_ = frame[2]
+        if id_ != 0xff:
+            return [build(id_, entries[id_])] if id_ in entries else []
+        return [build(key, entries[key]) for key in sorted(entries)] + [
+            build(0xff, None)]
+
+    def _handle_GetAlarm(self, frame):
+        def build(id_, alarm):
+            hour, minute, action = alarm or (0, 0, 0)
+            return _frame("AlarmResult", "BBBBBBHBBB", id_, _bcd(hour),
+                          _bcd(minute), 0, 0x02, 0, 0, action, 0,
+                          0x01 if alarm else 0)
+
+        return self._list(frame, self.alarms, build)
+
+    def _handle_GetScene(self, frame):
+        def build(id_, name):
+            text = (name or "").encode("ascii")
+            return _frame("SceneResult", "BBB%ss" % len(text), id_, 0,
+                          len(text), text)
+
+        return self._list(frame, self.scenes, build)
+
+    def _handle_GetVersion(self, frame):
+        return [_frame("VersionResult", "BHHHH", 0x01, 0x10, 0x2a, 0x2a, 0x01)]
+
+    def _handle_GetSerialNumber(self, frame):
+        serial = int(self.mac.replace(":", ""), 16)
+        return [_frame("SerialNumberResult", "12s", serial.to_bytes(12, "big"))]
+
+
+class Simulator:
+    """Transport factory for Lamp, keeping a simulated lamp per MAC.
+
+    latency is the one-way delay in seconds, jitter the maximum random
+    delay added on top of it, and loss the probability for a request or
+    a notification to get lost. drop is the probability for a request to
+    fail with a broken connection. Pass seed for reproducible runs.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, drop=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.drop = drop
+        self.lamps = {}
+        self.random = random.Random(seed)
+
+    def get_lamp(self, mac):
+        if mac not in self.lamps:
+            self.lamps[mac] = SimulatedLamp(mac)
+        return self.lamps[mac]
+
+    def delay(self):
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def lost(self):
+        return self.loss and self.random.random() < self.loss
+
+    def dropped(self):
+        return self.drop and self.random.random() < self.drop
+
+    @property
+    def errors(self):
+        return SimulatedTransport.errors
+
+    def __call__(self, mac):
+        return SimulatedTransport(mac, self)
+
+
+class SimulatedTransport(Transport):
+    """Connection to a simulated lamp."""
+
+    errors = (SimulationError,)
+    handle_errors = (SimulatedHandleError,)
+
+    def __init__(self, mac, simulator=None):
+        super().__init__(mac)
+        self._sim = simulator or Simulator()
+        self._lamp = self._sim.get_lamp(mac)
+        self._connected = False
+        self._notifications_enabled = False
+        self._pending = []  # heap of (due time, sequence, handle, data)
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        _LOGGER.debug("Connecting to simulated %s", self._mac)
+        time.sleep(2 * self._sim.delay())
+        if not self._lamp.reachable:
+            raise SimulationError("Unable to connect to %s" % self._mac)
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+        self._notifications_enabled = False
+        with self._lock:
+            self._pending = []
+
+    def get_characteristics(self, uuid=None):
+        chars = [SimulatedCharacteristic(NOTIFY_UUID, NOTIFY_HANDLE),
+                 SimulatedCharacteristic(CONTROL_UUID, CONTROL_HANDLE)]
+        if uuid:
+            return [char for char in chars if char.uuid == uuid]
+        return chars
+
+    def make_request(self, handle, value, timeout=0, with_response=False):
+        if not self._connected:
+            raise SimulationError("Not connected to %s" % self._mac)
+        if self._sim.dropped():
+            self.disconnect()
+            raise SimulationError("Connection to %s dropped" % self._mac)
+        if handle not in (CONTROL_HANDLE, REGISTER_NOTIFY_HANDLE):
+            raise SimulatedHandleError("%s has no handle %s" % (self._mac, handle))
+
+        if with_response:
+            # write request and response
+            time.sleep(2 * self._sim.delay())
+
+        res = {"rsp": ["wr"]} if with_response else None
+        if handle == REGISTER_NOTIFY_HANDLE:
+            self._notifications_enabled = value[0] == 0x01
+        elif handle == CONTROL_HANDLE and not self._sim.lost():
+            for data in self._lamp.handle_request(bytes(value)):
+                self._notify(data)
+
+        if timeout:
+            self.wait(timeout)
+
+        return res
+
+    def _notify(self, data):
+        if not self._notifications_enabled or self._sim.lost():
+            return
+        with self._lock:
+            self._sequence += 1
+            due = time.monotonic() + self._sim.delay()
+            heapq.heappush(self._pending, (due, self._sequence, NOTIFY_HANDLE, data))
+
+    def _deliver(self, until, condition=None):
+        """Delivers notifications due before until, stops early on condition."""
+        while True:
+            if condition is not None and condition:
+                return True
+            with self._lock:
+                now = time.monotonic()
+                if self._pending and self._pending[0][0] <= now:
+                    _, _, handle, data = heapq.heappop(self._pending)
+                else:
+                    data = None
+                    next_due = self._pending[0][0] if self._pending else until
+            if data is not None:
+                if handle in self._callbacks:
+                    try:
+                        self._callbacks[handle](data)
+                    except Exception as ex:
+                        _LOGGER.warning("Unable to handle notification %s: %s",
+                                        data.hex(), ex)
+                continue
+            if now >= until:
+                return condition is not None and bool(condition)
+            time.sleep(max(0, min(next_due, until) - now))
+
+    def wait(self, sec):
+        self._deliver(time.monotonic() + sec)
+
+    def wait_for(self, condition, timeout):
+        return self._deliver(time.monotonic() + timeout, condition)
+
+    def poll(self):
+        self._deliver(time.monotonic())
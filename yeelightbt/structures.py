@@ -239,14 +239,17 @@ NightMode = Struct(
     "end" / HourMinute,
 )
 
+# One step of a flow is uploaded per packet, then the flow is started or stored.
 ColorFlow = Struct(
     "id" / Byte, # 1-5 scene, 6 for what?
-    "pkt_num" / Byte,
-    "cmd" / Byte, # 1 start, 2 set, 3 stop, 4 store
-    "rgb_mode" / Byte, # 0 scene, 1 rgbb, 2 color temp
+    "pkt_num" / Default(Byte, 0), # index of the step
+    "cmd" / Enum(Byte, Start=0x01, Set=0x02, Stop=0x03, Store=0x04),
+    "rgb_mode" / Default(Enum(Byte, Scene=0x00, Color=0x01, Temperature=0x02), 0),
     Embedded(Color),
-    Embedded(Temperature),
-    "time" / Int16ub, # time range 0-600s
+    # as in Temperature, the brightness is repeated
+    "temperature" / Default(Int16ub, 0),
+    "brightness" / Default(Byte, 0),
+    "time" / Default(Int16ub, 0), # time range 0-600s
 )
 
 # TODO fixme incomplete, instead of RGB it should be temperature on two bytes when mode = temperature
@@ -254,7 +257,7 @@ SimpleFlow = Struct(
     "id" / Byte, # 1-5 scene, 6?
     "type" / Enum(Byte, Color=0x01, Temperature=0x02),
     "time" / Byte, # 0-255
-    "control" / Byte,
+    "control" / Default(Byte, 0),
     "first" / RGB,
     "second" / RGB,
     "third" / RGB,
@@ -349,6 +352,8 @@ Request = Padded(18,
             "GetScene": Default(Struct("id" / Byte), Pass), # 1-6, 255
             "GetSimpleFlow": Default(Struct("id" / Byte), Pass),
             "SetScene": Default(Scene, Pass),
+            "SetFlow": Default(ColorFlow, Pass),
+            "SetSimpleFlow": Default(SimpleFlow, Pass),
         }
         ),
     )
@@ -376,6 +381,25 @@ ResponseType = Enum(Byte,
     StatisticsResult=0x8d,
 )
 
+# The response the lamp sends back for a query.
+RESPONSE_FOR_REQUEST = {
+    "GetState": "StateResult",
+    "GetAlarm": "AlarmResult",
+    "GetScene": "SceneResult",
+    "GetName": "GetNameResult",
+    "GetBeacon": "BeaconResult",
+    "GetGradual": "GradualResult",
+    "GetVersion": "VersionResult",
+    "GetSerialNumber": "SerialNumberResult",
+    "GetTime": "TimeResult",
+    "Pair": "PairingResult",
+    "GetNightMode": "NightModeResult",
+    "GetSimpleFlow": "SimpleFlowResult",
+    "GetSleepTimer": "SleepTimerResult",
+    "GetWakeUp": "WakeUpResult",
+    "GetStatistics": "StatisticsResult",
+}
+
 Response = Padded(18,
     Struct(
         Const(0x43, Byte),
@@ -0,0 +1,251 @@
+"""
+Smooth transitions streamed from the host.
+
+For fades the lamp's flows cannot express, the engine interpolates from
+the current state to the target and writes a frame per tick:
+
+    engine = TransitionEngine(lamp, fps=20)
+    engine.fade(2, rgb=(255, 0, 0), brightness=80)
+    engine.wait()
+    print(engine.stats)
+
+Frames are computed for the time they are sent, so when the link falls
+behind the intermediate frames are dropped instead of queued up, and the
+lamp always gets the latest value. A new fade replaces the running one,
+starting from the last frame sent. The frame interval follows the
+measured write time when the link cannot keep up with the frame rate.
+"""
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_FPS = 20
+
+# weight of the latest write time in the average used for pacing
+PACING_WEIGHT = 0.2
+
+
+def _mix(start, end, progress):
+    return int(round(start + (end - start) * progress))
+
+
+class Target:
+    """State at the end of a transition, None values are not changed."""
+
+    def __init__(self, rgb=None, temperature=None, brightness=None):
+        if rgb is not None and temperature is not None:
+            raise ValueError("Either a color or a temperature can be faded to")
+        self.rgb = tuple(rgb) if rgb is not None else None
+        self.temperature = temperature
+        self.brightness = brightness
+
+
+class TransitionStats:
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.write_seconds = 0.0
+
+    @property
+    def fps(self):
+        """Frames written per second of transitions."""
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return ("<TransitionStats frames(%s) dropped(%s) unchanged(%s) "
+                "errors(%s) %.3fs, %.1f fps>" % (
+                    self.frames, self.dropped, self.unchanged, self.errors,
+                    self.elapsed, self.fps))
+
+
+class _Transition:
+    def __init__(self, start, target, duration):
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.started = time.monotonic()
+
+    def frame(self, now):
+        """Returns the (rgb, temperature, brightness) of now, and whether
+        it is the last frame."""
+        if self.duration > 0:
+            progress = min(1.0, (now - self.started) / self.duration)
+        else:
+            progress = 1.0
+        rgb, temperature, brightness = self.start
+        target = self.target
+        if target.rgb is not None:
+            rgb = tuple(_mix(a, b, progress) for a, b in zip(rgb, target.rgb))
+        if target.temperature is not None:
+            temperature = _mix(temperature, target.temperature, progress)
+        if target.brightness is not None:
+            brightness = _mix(brightness, target.brightness, progress)
+        return (rgb, temperature, brightness), progress >= 1.0
+
+
+class TransitionEngine:
+    """Streams interpolated frames to a lamp from a thread of its own.
+
+    fps is the highest frame rate, lower when the writes take longer.
+    The lamp has to keep its connection or use a pool, reconnecting for
+    every frame would not be streaming.
+    """
+
+    def __init__(self, lamp, fps=DEFAULT_FPS):
+        if not lamp._keep_connection and lamp._pool is None:
+            raise ValueError("%s has to keep its connection, or use a pool, "
+                             "to stream transitions" % lamp.mac)
+        self._lamp = lamp
+        self._interval = 1.0 / fps
+        self._cond = threading.Condition()
+        self._transition = None
+        self._thread = None
+        self._closed = False
+        # last frame sent by the running transition, and the lamp's mode
+        self._last = None
+        self._mode = None
+        self._write_time = 0.0
+        self.stats = TransitionStats()
+
+    @property
+    def fps(self):
+        """Frame rate the engine currently paces for."""
+        return 1.0 / max(self._interval, self._write_time)
+
+    @property
+    def running(self):
+        return self._transition is not None
+
+    def _current(self, target):
+        """Returns the state to start from, the last frame while running."""
+        lamp = self._lamp
+        if self._last is not None:
+            rgb, temperature, brightness = self._last
+        else:
+            rgb = tuple(lamp.color[:3]) if lamp.color else None
+            temperature, brightness = lamp.temperature, lamp.brightness
+            self._mode = lamp.mode
+        # a lamp showing white has no color to fade from, and vice versa
+        if target.rgb is not None and (rgb is None or self._mode != "Color"):
+            rgb = target.rgb
+        if target.temperature is not None and (temperature is None
+                                               or self._mode != "White"):
+            temperature = target.temperature
+        if brightness is None:
+            brightness = target.brightness
+        return rgb, temperature, brightness
+
+    def fade(self, duration, rgb=None, temperature=None, brightness=None):
+        """Starts fading to the given values within duration seconds,
+        replacing a running transition."""
+        target = Target(rgb, temperature, brightness)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The transition engine is closed")
+            start = self._current(target)
+            self._transition = _Transition(start, target, duration)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name="transition-%s" % self._lamp.mac)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Waits for the running transition, returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._transition is None, timeout)
+
+    def stop(self):
+        """Stops the running transition where it is."""
+        with self._cond:
+            self._transition = None
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._transition = None
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write(self, frame, mode):
+        rgb, temperature, brightness = frame
+        with self._lamp:
+            if mode == "rgb":
+                self._lamp.set_color(*rgb, brightness)
+                self._mode = "Color"
+            elif mode == "temperature":
+                self._lamp.set_temperature(temperature, brightness)
+                self._mode = "White"
+            else:
+                self._lamp.set_brightness(brightness)
+
+    def _run(self):
+        sent = None
+        while True:
+            with self._cond:
+                while self._transition is None and not self._closed:
+                    sent = self._last = None
+                    self._cond.wait()
+                if self._closed:
+                    return
+                transition = self._transition
+
+            now = time.monotonic()
+            frame, last = transition.frame(now)
+            target = transition.target
+            if target.rgb is not None:
+                mode = "rgb"
+            elif target.temperature is not None:
+                mode = "temperature"
+            else:
+                mode = "brightness"
+
+            if sent is not None:
+                self.stats.elapsed += now - sent
+                # the frames due since the last one are skipped
+                missed = int((now - sent) / self._interval) - 1
+                if missed > 0:
+                    self.stats.dropped += missed
+                    self._lamp._count("transition_dropped", mode, missed)
+            sent = now
+
+            if frame == self._last:
+                self.stats.unchanged += 1
+            else:
+                try:
+                    self._write(frame, mode)
+                    self._last = frame
+                    self.stats.frames += 1
+                    self._lamp._count("transition_frames", mode)
+                except Exception as ex:
+                    _LOGGER.warning("Transition frame to %s failed: %s",
+                                    self._lamp.mac, ex)
+                    self.stats.errors += 1
+            took = time.monotonic() - now
+            self._write_time += PACING_WEIGHT * (took - self._write_time)
+            self.stats.write_seconds += took
+
+            with self._cond:
+                if last:
+                    self.stats.elapsed += took
+                    if self._transition is transition:
+                        self._transition = None
+                        self._cond.notify_all()
+                    continue
+                # pace for the frame rate, or for the link if it is slower
+                delay = max(self._interval, self._write_time) - took
+                if delay > 0:
+                    self._cond.wait(delay)
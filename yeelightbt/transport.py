@@ -0,0 +1,71 @@
+""" Interface for the connections used by Lamp. """
+import time
+
+
+class Transport:
+    """Base class for a connection to a single lamp.
+
+    Lamp only uses the methods defined here, so anything implementing them
+    (see connection.BTLEConnection and simulator.SimulatedTransport)
+    can be passed to it. Notifications are delivered to the registered
+    callbacks while wait() or wait_for() is running.
+    """
+
+    # exceptions signalling a broken connection, retried by Lamp
+    errors = ()
+    # exceptions signalling a handle the lamp does not have, while the
+    # connection itself is still fine
+    handle_errors = ()
+
+    def __init__(self, mac):
+        self._mac = mac
+        self._callbacks = {}
+
+    @property
+    def pushes_notifications(self):
+        """True if notifications are delivered without wait() or poll()."""
+        return False
+
+    @property
+    def mac(self):
+        """Return the MAC address of the connected device."""
+        return self._mac
+
+    def connect(self):
+        raise NotImplementedError()
+
+    def disconnect(self):
+        raise NotImplementedError()
+
+    def get_characteristics(self, uuid=None):
+        """Returns a list of characteristics, each having getHandle()."""
+        raise NotImplementedError()
+
+    def set_callback(self, handle, function):
+        """Set the callback for a Notification handle. It will be called with the parameter data, which is binary."""
+        self._callbacks[handle] = function
+
+    def make_request(self, handle, value, timeout=0, with_response=False):
+        """Writes the value to the given handle."""
+        raise NotImplementedError()
+
+    def wait(self, sec):
+        """Handles notifications for the given amount of seconds."""
+        raise NotImplementedError()
+
+    def poll(self):
+        """Handles already pending notifications without blocking."""
+        raise NotImplementedError()
+
+    def wait_for(self, condition, timeout):
+        """Handles notifications until condition becomes true.
+
+        Returns False if that did not happen in timeout seconds."""
+        end = time.time() + timeout
+        while not condition:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            self.wait(min(remaining, 0.1))
+
+        return True